@@ -0,0 +1,108 @@
+'''
+#~ asyncio orchestration for the ADC, the pH probe, housekeeping and the sinks.
+
+Every device and sink is a coroutine on one event loop, and every blocking
+driver call is pushed to an executor:
+
+windows       acquire() (e.g. multiplex) back to back on a one-thread ADC
+              executor, because every call talks to the same SPI device
+housekeeping  the temperature and reference reads of a housekeeping.Housekeeping,
+              on the same ADC executor whenever one is due, so they run
+              between windows and never alongside one
+pH            pH_poller.PHPoller.poll_once() on its own executor: the probe's
+              900 ms I2C conversion overlaps the ADC windows
+sinks         one bounded asyncio.Queue each, written from the I/O executor
+
+A cycle is then as long as the slowest device or sink, not the sum of them.
+Every sink is called as sink(start, result), where start is the time.time()
+the window started and result is what acquire() returned; the pH and the
+housekeeping values are read from the poller and the Housekeeping as usual.
+
+Usage:
+asyncio.run(AsyncRunner(acquire, [write_row], pH_poller = pH_poller, housekeeping = housekeeping).run())
+
+'''
+
+import asyncio, time
+from concurrent.futures import ThreadPoolExecutor
+
+class AsyncRunner(object):
+    ''' Runs acquire() back to back, polls the pH probe and housekeeping reads alongside it,
+        and fans each result out to the sinks. '''
+
+    def __init__(self, acquire, sinks, queue_size = 8, pH_poller = None, housekeeping = None):
+        self.acquire = acquire
+        self.sinks = list(sinks)
+        self.queue_size = queue_size
+        self.pH_poller = pH_poller # not started: polled from _poll_pH() instead
+        self.housekeeping = housekeeping
+        if housekeeping is not None:
+            housekeeping.scheduled = True # acquire() no longer makes the reads itself
+
+    async def _drain(self, loop, records, sink):
+        while True:
+            record = await records.get()
+            if record is None:
+                return
+            try:
+                await loop.run_in_executor(self.io_executor, sink, *record)
+            except Exception as e:
+                print("Error in sink", getattr(sink, '__name__', sink))
+                print(e)
+
+    async def _poll_pH(self, loop):
+        while True:
+            try:
+                await loop.run_in_executor(self.pH_executor, self.pH_poller.poll_once)
+            except Exception as e: # poll_once() handles IOError; anything else ends the polling, as it ends PHPoller's thread
+                print("Error polling the pH probe")
+                print(e)
+                return
+            await asyncio.sleep(self.pH_poller.interval)
+
+    async def _refresh_housekeeping(self, loop):
+        while True:
+            wait = self.housekeeping.next_due()
+            if wait is None:
+                return
+            await asyncio.sleep(wait)
+            await loop.run_in_executor(self.adc_executor, self.housekeeping.read_due) # queued behind the current window
+
+    async def run(self, cycles = None):
+        ''' Acquires cycles windows (forever if None). Sinks are flushed before returning. '''
+        loop = asyncio.get_running_loop()
+        self.adc_executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'adc')
+        self.io_executor = ThreadPoolExecutor(max_workers = max(len(self.sinks), 1), thread_name_prefix = 'sink')
+        self.pH_executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'pH')
+        queues = [asyncio.Queue(maxsize = self.queue_size) for sink in self.sinks]
+        drains = [asyncio.ensure_future(self._drain(loop, records, sink)) for records, sink in zip(queues, self.sinks)]
+        devices = []
+        cycle = 0
+        try:
+            if self.pH_poller is not None:
+                devices.append(asyncio.ensure_future(self._poll_pH(loop)))
+            if self.housekeeping is not None:
+                await loop.run_in_executor(self.adc_executor, self.housekeeping.read_due) # the first window needs a reference
+                devices.append(asyncio.ensure_future(self._refresh_housekeeping(loop)))
+            while cycles is None or cycle < cycles:
+                start = time.time()
+                result = await loop.run_in_executor(self.adc_executor, self.acquire)
+                record = (start, result)
+                for records in queues:
+                    await records.put(record) # bounded: a slow sink pauses acquisition
+                cycle += 1
+        finally:
+            for device in devices:
+                device.cancel()
+            if self.pH_poller is not None:
+                self.pH_poller.stop() # ends a reading that is waiting on the probe
+            await asyncio.gather(*devices, return_exceptions = True)
+            # On Ctrl-C the awaited window is cancelled but its thread keeps using the ADC:
+            # wait for it, so the caller's adc.end() never runs alongside it.
+            self.adc_executor.shutdown(wait = True)
+            self.pH_executor.shutdown(wait = True)
+            for records in queues:
+                await records.put(None)
+            await asyncio.gather(*drains)
+            self.io_executor.shutdown(wait = True)
+        return cycle
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+'''
+#~ Throughput benchmark for the acquisition loop.
+
+Runs a script's own multiplex(), GaN_measurement() and write_to_csv() on
+the simulated ADS1261 (see instrument_backend.py), which produces
+conversions on the real-time schedule of the configured data rate and
+filter, so the cycle times are the ones the Pi would see minus SPI and GPIO
+latency. For every combination of window, data rate, digital filter and
+number of measurement pairs it reports:
+
+cycles_per_second   full multiplex() + write_to_csv() cycles per second
+ideal_cycle         time the ADC itself needs per cycle: settling plus
+                    window conversions for every pair, plus the temperature
+                    readback
+dead_time           measured cycle time minus ideal_cycle
+per_pair_overhead   dead_time per measurement pair
+csv_write           time spent in write_to_csv() per cycle
+
+The results are saved as JSON; pass --compare with an earlier file to print
+the change in cycles/s for every configuration both files contain.
+
+python3 benchmark.py
+python3 benchmark.py --window 10 100 --data-rate 1200 7200 --pairs 1 3 --output before.json
+python3 benchmark.py --output after.json --compare before.json
+
+'''
+
+import os, sys, json, time, shutil, argparse, platform, tempfile, itertools, functools
+from datetime import datetime
+
+os.environ['DATALOGGER_BACKEND'] = 'simulated' # before any script imports its ADC driver
+
+from datalogger import load_mode
+from instrument_backend import conversion_period, filter_latency, data_rates, digital_filters
+from settling import settling_time
+
+# Modes whose multiplex() and write_to_csv() share the array script's signatures.
+benchmarked_modes = ['array', 'single-pad']
+
+pair_pool = [['AIN3', 'AIN2'], ['AIN7', 'AIN6'], ['AIN9', 'AIN8'], ['AIN1', 'AIN0'], ['AIN5', 'AIN4'], ['AIN8', 'AIN7']]
+
+def ideal_cycle(pairs, window, data_rate, digital_filter, CHOP = 'normal', DELAY = '50us'):
+    ''' Conversion time (s) per multiplex() cycle if there were no software overhead at all. '''
+    per_pair = settling_time(data_rate, digital_filter, CHOP, DELAY) + (window - 1) * conversion_period(data_rate, CHOP)
+    return pairs * per_pair + filter_latency(data_rate, digital_filter, CHOP, DELAY) # check_temperature() costs one settled conversion
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+def run_configuration(script, directory, window, data_rate, digital_filter, pairs, cycles = 5, acquisition = 'drdy'):
+    ''' Times cycles full cycles of one configuration. Returns a dict of results. '''
+    measurement_pairs = pair_pool[:pairs]
+    adc = script.initialise_instruments()
+    reference = adc.power_readback()/2
+    script.setup(adc = adc, adc_frequency = data_rate, digital_filter = digital_filter, BYPASS = 0, gain = 1)
+    _, STATENB_status, _, _, _, _, _, _ = adc.check_mode3()
+    status_byte = 'disabled' if STATENB_status == 0 else 'enabled'
+    data_ready = script.DataReady(adc) if acquisition == 'drdy' else None
+    acquire = functools.partial(script.multiplex, adc, measurement_pairs, None, 1, reference, window, status_byte, data_rate, digital_filter,
+        data_ready = data_ready, buffer = script.WindowBuffer(window))
+    fieldnames = ['Date', 'Time', 'Reference Voltage (mV)']
+    for positive, negative in measurement_pairs:
+        fieldnames.extend([positive + '-' + negative + ' (mV)', 'Standard deviation of ' + positive + '-' + negative + ' (uV)'])
+    fieldnames.append('Air Temperature from ADS1261 (deg C)')
+    csv_sink = script.CSVSink(os.path.join(directory, 'benchmark.csv'), fieldnames)
+
+    acquire() # the first cycle includes the one-off gain and register set-up
+    cycle_times, write_times = [], []
+    missed = adc.conversions_missed
+    try:
+        for cycle in range(cycles):
+            started = time.perf_counter()
+            result = acquire()
+            written = time.perf_counter()
+            measurement_date, measurement_time = script.get_experiment_time()
+            script.write_to_csv(csv_sink, measurement_date, measurement_time, result, measurement_pairs)
+            finished = time.perf_counter()
+            cycle_times.append(finished - started)
+            write_times.append(finished - written)
+    finally:
+        csv_sink.close()
+        adc.stop()
+    CHOP, _, DELAY = adc.check_mode1()
+    ideal = ideal_cycle(pairs, window, data_rate, digital_filter, CHOP, DELAY)
+    mean = sum(cycle_times) / len(cycle_times)
+    return {
+        'window': window, 'data_rate': data_rate, 'digital_filter': digital_filter, 'pairs': pairs, 'acquisition': acquisition,
+        'cycles': cycles,
+        'cycles_per_second': 1 / mean,
+        'mean_cycle': mean,
+        'median_cycle': percentile(cycle_times, 0.5),
+        'p95_cycle': percentile(cycle_times, 0.95),
+        'ideal_cycle': ideal,
+        'dead_time': mean - ideal,
+        'dead_fraction': (mean - ideal) / mean,
+        'per_pair_overhead': (mean - ideal) / pairs,
+        'csv_write': sum(write_times) / len(write_times),
+        'conversions_missed': adc.conversions_missed - missed,
+    }
+
+def configuration_key(result):
+    return (result['window'], result['data_rate'], result['digital_filter'], result['pairs'], result['acquisition'])
+
+def compare(results, previous_file):
+    ''' Prints the change in cycles/s against an earlier run of this benchmark. '''
+    try:
+        with open(previous_file) as previous:
+            previous = {configuration_key(result): result for result in json.load(previous)['results']}
+    except (IOError, ValueError, KeyError) as e:
+        print("Unable to read", previous_file)
+        print(e)
+        return 1
+    print("Compared with", previous_file)
+    for result in results:
+        before = previous.get(configuration_key(result))
+        if before is not None:
+            change = 100 * (result['cycles_per_second'] / before['cycles_per_second'] - 1)
+            print(configuration_key(result), round(before['cycles_per_second'], 3), '->', round(result['cycles_per_second'], 3), "cycles/s", '(' + '%+.1f' % change + '%)')
+    return 0
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = "Acquisition loop throughput on the simulated ADS1261")
+    parser.add_argument('--mode', choices = benchmarked_modes, default = 'array', help = "script whose acquisition code is timed")
+    parser.add_argument('--window', type = int, nargs = '+', default = [10, 100], help = "conversions per pair")
+    parser.add_argument('--data-rate', type = float, nargs = '+', default = [1200, 7200], help = "ADC data rates (SPS)")
+    parser.add_argument('--filter', nargs = '+', default = ['sinc2'], choices = digital_filters, help = "digital filters")
+    parser.add_argument('--pairs', type = int, nargs = '+', default = [1, 3, 6], help = "numbers of measurement pairs")
+    parser.add_argument('--acquisition', choices = ['drdy', 'polling'], default = 'drdy')
+    parser.add_argument('--cycles', type = int, default = 5, help = "timed cycles per configuration")
+    parser.add_argument('--output', default = 'benchmark_' + datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + '.json', help = "JSON results file")
+    parser.add_argument('--compare', help = "earlier JSON results file to compare against")
+    arguments = parser.parse_args(arguments)
+    for data_rate in arguments.data_rate:
+        if data_rate not in data_rates:
+            parser.error("unsupported data rate: " + str(data_rate))
+    if max(arguments.pairs) > len(pair_pool):
+        parser.error("at most " + str(len(pair_pool)) + " pairs")
+
+    script = load_mode(arguments.mode)
+    directory = tempfile.mkdtemp(prefix = 'benchmark_')
+    results = []
+    print("Window \t Rate \t Filter \t Pairs \t Cycles/s \t Ideal (s) \t Dead time (s) \t Per pair (s) \t CSV (s)")
+    try:
+        for window, data_rate, digital_filter, pairs in itertools.product(arguments.window, arguments.data_rate, arguments.filter, arguments.pairs):
+            data_rate = int(data_rate) if data_rate == int(data_rate) else data_rate
+            result = run_configuration(script, directory, window, data_rate, digital_filter, pairs, arguments.cycles, arguments.acquisition)
+            results.append(result)
+            print(window, '\t', data_rate, '\t', digital_filter, '\t\t', pairs, '\t', round(result['cycles_per_second'], 3), '\t\t', round(result['ideal_cycle'], 4),
+                '\t\t', round(result['dead_time'], 4), '\t\t', round(result['per_pair_overhead'], 5), '\t', round(result['csv_write'], 6))
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+
+    report = {
+        'created': datetime.now().isoformat(),
+        'mode': arguments.mode,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    try:
+        with open(arguments.output, 'w') as output:
+            json.dump(report, output, indent = 1)
+        print("Results saved to", arguments.output)
+    except IOError as e:
+        print("Unable to save results")
+        print(e)
+        return 1
+    if arguments.compare:
+        return compare(results, arguments.compare)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+'''
+#~ Compact binary log of window results.
+
+The CSV files store every median as text, which makes multi-week runs large
+and slow to load. A binary log is append-only:
+
+magic           b'GANLOG1\n'
+header length   uint32, little-endian
+header          JSON: field names, units, gain, reference, measurement pairs
+records         fixed width: float64 time.time() of the window start, then
+                one float64 per field (NaN where there is no value, e.g. pH
+                when the probe is not connected)
+
+Every value keeps the full precision of the CSV. Version 1 logs stored the
+fields as float32 (about 7 significant digits, i.e. 0.1 uV on a 1 V
+reading); they are still read and appended to in that format.
+
+read_log() maps the records straight into a NumPy structured array, and
+to_csv() writes the same layout as the scripts' CSV files.
+
+Usage:
+python3 binary_log.py results.bin [results.csv]
+
+'''
+
+import os, sys, csv, json, math, struct, time
+from datetime import datetime
+
+magic = b'GANLOG1\n'
+header_length = struct.Struct('<I')
+
+def units_of(fieldname):
+    ''' "Sense Pad 1 (mV)" -> "mV" '''
+    if fieldname.endswith(')') and '(' in fieldname:
+        return fieldname[fieldname.rindex('(') + 1:-1]
+    return ''
+
+def field_format(header):
+    ''' The struct format of one field: float32 in version 1 logs, float64 since. '''
+    return 'f' if header.get('version', 1) == 1 else 'd'
+
+def record_struct(header):
+    return struct.Struct('<d' + field_format(header) * len(header['fields']))
+
+def read_header(logfile):
+    ''' Reads the header from an open log file. Returns (header, offset of the first record). '''
+    if logfile.read(len(magic)) != magic:
+        raise ValueError("Not a binary log: " + str(getattr(logfile, 'name', logfile)))
+    length, = header_length.unpack(logfile.read(header_length.size))
+    header = json.loads(logfile.read(length).decode('utf-8'))
+    return header, len(magic) + header_length.size + length
+
+class BinaryLog(object):
+    ''' Appends window results to a binary log. fields are the CSV fieldnames after Date and Time. '''
+
+    def __init__(self, path, fields, gain = None, reference = None, measurement_pairs = None, time_separator = ':', flush_rows = 20):
+        self.path = path
+        self.fields = list(fields)
+        self.flush_rows = flush_rows
+        self.pending = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as logfile:
+                self.header, offset = read_header(logfile)
+            if self.header['fields'] != self.fields:
+                raise ValueError("Fields do not match the existing log " + path)
+            self.record = record_struct(self.header)
+            self.logfile = open(path, 'ab')
+            # drop a partial record left by a power cut
+            size = os.path.getsize(path)
+            self.logfile.truncate(size - (size - offset) % self.record.size)
+            return
+        self.header = {
+            'version': 2,
+            'fields': self.fields,
+            'units': [units_of(field) for field in self.fields],
+            'gain': gain,
+            'reference': reference,
+            'measurement_pairs': measurement_pairs,
+            'time_separator': time_separator,
+            'created': time.time(),
+        }
+        self.record = record_struct(self.header)
+        header = json.dumps(self.header).encode('utf-8')
+        self.logfile = open(path, 'wb')
+        self.logfile.write(magic + header_length.pack(len(header)) + header)
+        self.logfile.flush()
+
+    def write(self, timestamp, values):
+        ''' Appends one record. Values that are not numbers are stored as NaN. '''
+        if len(values) != len(self.fields):
+            raise ValueError("Record has " + str(len(values)) + " values for " + str(len(self.fields)) + " fields")
+        record = [timestamp]
+        for value in values:
+            try:
+                record.append(float(value))
+            except (TypeError, ValueError):
+                record.append(math.nan)
+        self.logfile.write(self.record.pack(*record))
+        self.pending += 1
+        if self.pending >= self.flush_rows:
+            self.flush()
+        return 0
+
+    def flush(self):
+        self.logfile.flush()
+        self.pending = 0
+        return 0
+
+    def close(self):
+        if not self.logfile.closed:
+            self.flush()
+            self.logfile.close()
+        return 0
+
+def read_log(path):
+    ''' Returns (header, records). records is a NumPy structured array with a 'time'
+        column and one column per field. '''
+    import numpy as np
+    with open(path, 'rb') as logfile:
+        header, offset = read_header(logfile)
+    dtype = np.dtype([('time', '<f8')] + [(field, '<' + field_format(header)) for field in header['fields']])
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    records = np.fromfile(path, dtype = dtype, count = count, offset = offset)
+    return header, records
+
+def iterate_log(path):
+    ''' Yields (timestamp, values) for every record without needing NumPy. '''
+    with open(path, 'rb') as logfile:
+        header, offset = read_header(logfile)
+        record = record_struct(header)
+        while True:
+            data = logfile.read(record.size)
+            if len(data) < record.size:
+                return
+            unpacked = record.unpack(data)
+            yield unpacked[0], unpacked[1:]
+
+def to_csv(path, csv_file = None):
+    ''' Writes the log in the scripts' CSV layout. Returns the CSV file name. '''
+    if csv_file is None:
+        csv_file = os.path.splitext(path)[0] + '.csv'
+    with open(path, 'rb') as logfile:
+        header, _ = read_header(logfile)
+    separator = header.get('time_separator', ':')
+    text = (lambda value: '%.7g' % value) if field_format(header) == 'f' else repr
+    with open(csv_file, 'w', newline = '') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Date', 'Time'] + header['fields'])
+        for timestamp, values in iterate_log(path):
+            timestamp = datetime.fromtimestamp(timestamp)
+            measurement_date = str(timestamp.year)+'-'+str(timestamp.month)+'-'+str(timestamp.day)
+            measurement_time = separator.join([str(timestamp.hour), str(timestamp.minute), str(timestamp.second)])+'.'+str(timestamp.microsecond)
+            writer.writerow([measurement_date, measurement_time] + ['' if math.isnan(value) else text(value) for value in values])
+    return csv_file
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python3 binary_log.py results.bin [results.csv]")
+        return 1
+    csv_file = to_csv(*sys.argv[1:])
+    print("Written", csv_file)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,22 @@
 #~ Constant current datalogger.
 # Requires connection of the ads1261evm and a Atlas Scientific pH meter
 
-import sys
+from instrument_backend import load_adc, load_dac, load_pH_probe
+ads1261 = load_adc() # set DATALOGGER_BACKEND=simulated to run without the ads1261evm
+dac7562 = load_dac()
+pH_probe = load_pH_probe()
+from register_cache import CachedADC
+from data_ready import DataReady, collect_conversion
+from streaming_stats import RunningStatistics
+from status_display import StatusDisplay, field_table
 
-path_to_ads1261evm = "/home/pi/Documents/ads1261evm/"
-path_to_dac7562evm = "/home/pi/Documents/dac7562evm/"
-path_to_AS_pH_meter = "/home/pi/Documents/AtlasScientific_pHmeter"
-
-sys.path.insert(0, path_to_ads1261evm)
-sys.path.insert(0, path_to_dac7562evm)
-sys.path.insert(0, path_to_AS_pH_meter)
-
-from ads1261evm import ADC1261 as ads1261
-from dac7562evm import DAC7562 as dac7562
-from AtlasScientific_pHmeter import AS_pH_I2C as pH_probe
-
-import numpy as np
-import matplotlib.pyplot as plt
 import time
-import statistics
 from datetime import datetime
 import csv
 
 # set up
 def initialise_instruments():
-	adc = ads1261()
+	adc = CachedADC(ads1261()) # shadow registers drop redundant SPI writes
 	adc.setup_measurements()
 	DeviceID, RevisionID = adc.check_ID()
 	print(DeviceID, RevisionID)
@@ -73,17 +65,20 @@ def setup(adc,
 # keep under 4 kb and append mode -a flag (not -w or -r)
 # repeat
 
-def GaN_measurement(adc, positive, negative, reference, gain):
+def GaN_measurement(adc, positive, negative, reference, gain, data_ready = None):
 	adc.choose_inputs(positive = positive, negative = negative)
 	adc.gpio("START","high") # starts the ADC from taking measurements
 	response = None
 	while(response == None or type(response) != float):
 		try:
-			response = adc.collect_measurement(method='hardware', reference = reference, gain = gain)
+			response = collect_conversion(adc, data_ready, reference = reference, gain = gain) # with data_ready this blocks on the DRDY edge instead of spinning
 			if (type(response)==float):
 				return response
 		except KeyboardInterrupt:
 			adc.end()
+		except TimeoutError as e:
+			print(e)
+			return None
 
 
 def main():
@@ -97,6 +92,10 @@ def main():
 		current_out_pin = 'AIN0')
 		#~ gain = 1)
 	BYPASS, gain = adc.check_PGA()
+	acquisition = 'drdy' # 'drdy' waits for the data-ready edge, 'polling' spins on collect_measurement
+	data_ready = DataReady(adc) if acquisition == 'drdy' else None
+	status_interval = 1 # seconds between console status updates, None for headless runs (see status_display.py)
+	status = StatusDisplay(field_table, interval = status_interval).start()
 	#~ reference = adc.power_readback(power = 'analog')
 	reference = 2500
 	#~ reference = GaN_measurement(adc, positive = 'AVDD'
@@ -124,7 +123,7 @@ def main():
 	stdev_data = []
 	
 	for pair in range(len(measurement_pairs)):
-		data.append([])
+		data.append(RunningStatistics()) # constant memory however long the writing interval
 		averaged_data.append([])
 		stdev_data.append([])
 
@@ -169,12 +168,12 @@ def main():
 				commercial_pH = pH_meter.single_output()
 				if commercial_pH in [254, 254.0, str(254), str(254.0), 255, 255.0, str(255), str(255.0)]: # if its an error code, collect other measurements
 					for each_pair in range(len(measurement_pairs)): # collect GaN measurements
-						measurement_GaN = GaN_measurement(adc, positive = measurement_pairs[each_pair][0], negative = measurement_pairs[each_pair][1], reference = reference, gain = gain)
-						if each_pair == 5:
+						measurement_GaN = GaN_measurement(adc, positive = measurement_pairs[each_pair][0], negative = measurement_pairs[each_pair][1], reference = reference, gain = gain, data_ready = data_ready)
+						if each_pair == 5 and measurement_GaN is not None:
 							measurement_GaN = current_check(voltage = measurement_GaN, resistance = 1.5)
 							#~ print("Current:", measurement_GaN, "(uA)")
 						if measurement_GaN is not None:
-							data[each_pair].append(measurement_GaN)
+							data[each_pair].update(measurement_GaN)
 						#~ data[each_pair].append(None)
 						
 				else:
@@ -182,15 +181,15 @@ def main():
 
 					for each_pair in range(len(measurement_pairs)):
 						try:
-							mean = statistics.mean(data[each_pair])
-							standard_deviation = statistics.stdev(data[each_pair])
+							mean = data[each_pair].mean()
+							standard_deviation = data[each_pair].stdev()
 							averaged_data[each_pair].append(mean)
 							stdev_data[each_pair].append(standard_deviation)
 							write = 1 # write to csv because we have data
 						except:
 							write = 0
 							print("Error no mean")
-						data[each_pair] = []
+						data[each_pair].reset()
 				
 					if write == 1:
 						air_temperature = adc.check_temperature()
@@ -217,18 +216,7 @@ def main():
 					writer = csv.writer(csvfile)
 					writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
 					for datapoint in range(len(date_for_csv)):
-						print(fieldnames[0],date_for_csv[datapoint],"\t",
-										fieldnames[1],time_for_csv[datapoint],"\n",
-										fieldnames[2],round(averaged_data[0][datapoint],2),"(",round(stdev_data[0][datapoint],4),")","\t",
-										fieldnames[4],round(averaged_data[1][datapoint],2),"(",round(stdev_data[1][datapoint],4),")","\n",
-										fieldnames[6],round(averaged_data[2][datapoint],2),"(",round(stdev_data[2][datapoint],4),")","\t",
-										fieldnames[8],round(averaged_data[3][datapoint],2),"(",round(stdev_data[3][datapoint],4),")","\n",
-										fieldnames[10],round(averaged_data[4][datapoint],2),"(",round(stdev_data[4][datapoint],4),")","\t",
-										fieldnames[12],round(averaged_data[5][datapoint],2),"(",round(stdev_data[5][datapoint],4),")","\n",
-										fieldnames[14],round(pH_measurements_for_csv[datapoint],2),"\t",
-										fieldnames[15],round(temperature_for_csv[datapoint],2),"\n",
-										"Total potential:", round(averaged_data[0][datapoint]+averaged_data[1][datapoint]+averaged_data[2][datapoint]+averaged_data[3][datapoint]+averaged_data[4][datapoint]+averaged_data[5][datapoint]*100e-6*1.5,2),"mV\n")				
-						writer.writerow({
+						row = {
 										fieldnames[0]:date_for_csv[datapoint],
 										fieldnames[1]:time_for_csv[datapoint],
 										fieldnames[2]:round(averaged_data[0][datapoint],2),
@@ -245,7 +233,9 @@ def main():
 										fieldnames[13]:round(stdev_data[5][datapoint],4),
 										fieldnames[14]:round(pH_measurements_for_csv[datapoint],2),
 										fieldnames[15]:round(temperature_for_csv[datapoint],2)
-										})
+										}
+						writer.writerow(row)
+					status.publish(fieldnames, row, [("Total potential (mV)", round(averaged_data[0][datapoint]+averaged_data[1][datapoint]+averaged_data[2][datapoint]+averaged_data[3][datapoint]+averaged_data[4][datapoint]+averaged_data[5][datapoint]*100e-6*1.5,2))]) # latest datapoint, shown by the status thread
 			except IOError:
 				print("Unable to save to csv")	
 			except KeyboardInterrupt:
@@ -256,7 +246,7 @@ def main():
 			
 		# clear all appended data
 		for pair in range(len(measurement_pairs)):
-			data[pair] = []
+			data[pair].reset()
 			averaged_data[pair] = []
 		pH_measurements_for_csv, GaN_measurements_for_csv, temperature_for_csv, date_for_csv, time_for_csv = [], [], [], [], []
 		
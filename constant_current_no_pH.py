@@ -1,26 +1,33 @@
 #~ Constant current datalogger.
 # Requires connection of the ads1261evm and a Atlas Scientific pH meter
 
-import sys, statistics, csv, threading, queue, time
-import numpy as np
-import matplotlib.pyplot as plt
+import sys, threading, queue, time, functools
 from datetime import datetime
 
-path_to_ads1261evm = "/home/pi/Documents/ads1261evm/"
-path_to_dac7562evm = "/home/pi/Documents/dac7562evm/"
-path_to_AS_pH_meter = "/home/pi/Documents/AtlasScientific_pHmeter"
+from instrument_backend import load_adc, load_dac, load_pH_probe
+ads1261 = load_adc() # set DATALOGGER_BACKEND=simulated to run without the ads1261evm
+pH_probe = load_pH_probe()
+dac7562 = load_dac()
+from register_cache import CachedADC
+from data_ready import DataReady
+from window_buffer import WindowBuffer
+from settling import settling_conversions, discard_conversions
+from instrumentation import no_probes
+from housekeeping import Housekeeping
+from workers import LoopWorker, WriterWorker, put, shutdown
+from csv_sink import CSVSink
+from status_display import StatusDisplay, window_table
 
-sys.path.insert(0, path_to_ads1261evm)
-sys.path.insert(0, path_to_dac7562evm)
-sys.path.insert(0, path_to_AS_pH_meter)
-
-from ads1261evm import ADC1261 as ads1261
-from dac7562evm import DAC7562 as dac7562
-from AtlasScientific_pHmeter import AS_pH_I2C as pH_probe
+def get_experiment_time(timestamp = None):
+    if timestamp is None:
+        timestamp = datetime.now()
+    measurement_date = str(timestamp.year)+'-'+str(timestamp.month)+'-'+str(timestamp.day)
+    measurement_time = str(timestamp.hour)+':'+str(timestamp.minute)+':'+str(timestamp.second)+'.'+str(timestamp.microsecond)
+    return measurement_date, measurement_time
 
 def initialise_instruments():
     ''' Sets up the device. '''
-    adc = ads1261()
+    adc = CachedADC(ads1261()) # shadow registers drop redundant SPI writes
     adc.setup_measurements()
     adc.reset()
     DeviceID, RevisionID = adc.check_ID()
@@ -91,76 +98,90 @@ def check_maximum_gain(adc, measurement_pairs):
 # keep under 4 kb and append mode -a flag (not -w or -r)
 # repeat
 
-def GaN_measurement(adc, positive, negative, reference, gain, window = 10, status_byte = 'enabled'):
+def GaN_measurement(adc, positive, negative, reference, gain, window = 10, status_byte = 'enabled', data_ready = None, buffer = None, discard = 0, gain_table = None, archive = None, pair = 0, probes = no_probes, convergence = None):
+    ''' Returns the median and standard deviation of one window, and the number of conversions it used. '''
     adc.stop() # stop measurements and allows the register to be changed.
+    probes.lap('stop')
+    if gain_table is not None: # probe before switching, the probe moves the mux
+        gain = gain_table.gain(adc, positive, negative)
+        probes.lap('gain probe')
     adc.choose_inputs(positive = positive, negative = negative)
-    #~ adc.PGA(BYPASS = 0, GAIN = gain)
+    probes.lap('choose_inputs')
+    if gain_table is not None: # per-pair gain, applied with the mux switch
+        adc.PGA(BYPASS = 0, GAIN = gain)
+        probes.lap('PGA')
     adc.start1() # starts measurements and prevents register changes.
-    response = None
-    samples = []
-    for i in range(window):
-        try:
-            response = adc.collect_measurement(method='hardware', reference = reference, gain = gain, status = status_byte, bits = True)
-            response = abs(response) # remove this if necessary
-            #~ print(response)
-            samples.append(response)
-        except KeyboardInterrupt:
-            adc.end()
-    return np.median(samples), np.std(samples)
+    probes.lap('start1')
+    if buffer is None or buffer.window != window:
+        buffer = WindowBuffer(window)
+    until = convergence.rule(positive, negative, reference, gain) if convergence is not None else None # window is then the maximum
+    try:
+        discard_conversions(adc, discard, data_ready, status = status_byte) # drop anything converted before the inputs settled
+        probes.lap('discard')
+        buffer.read(adc, data_ready, reference = reference, gain = gain, status = status_byte, absolute = True, probes = probes, until = until) # remove absolute if necessary
+        if archive is not None:
+            archive.write(pair, buffer.codes[:buffer.count], gain)
+            probes.lap('archive')
+    except KeyboardInterrupt:
+        adc.end()
+    if gain_table is not None:
+        gain_table.check(adc, positive, negative, buffer.peak_code())
+        probes.lap('gain check')
+    median, standard_deviation = buffer.median_and_std()
+    probes.lap('statistics')
+    return median, standard_deviation, buffer.count
 
-def multiplex(adc, measurement_pairs, result_queue, gain, reference = 5000, window = 100, status_byte = 'enabled', data_rate = 7200, digital_filter = 'sinc2'):
-    medians, standard_deviations = [], []
+def multiplex(adc, measurement_pairs, result_queue, gain, reference = 5000, window = 100, status_byte = 'enabled', data_rate = 7200, digital_filter = 'sinc2', data_ready = None, buffer = None, gain_table = None, archive = None, probes = no_probes, housekeeping = None, convergence = None, analog_settling = 0):
+    medians, standard_deviations, samples = [], [], []
+    started = probes.begin()
     #~ external_reference = adc.ac_simple('AC') # need to grab the current then replace the ac-excitation settings
-    external_reference = adc.power_readback()
-    setup(adc)
+    if housekeeping is None:
+        external_reference = adc.power_readback()
+        refreshed = True
+    else:
+        refreshed = housekeeping.refresh() # only the reads that are due
+        external_reference = housekeeping.value('reference')
     #~ external_reference = 5000 # reference voltage, not completely accurate
-    adc.PGA(BYPASS = 0, GAIN = gain)
-    adc.set_frequency(data_rate = data_rate, digital_filter = digital_filter, print_freq = False)
-    adc.mode3(PWDN = 0,
-        STATENB = 1,
-        CRCENB = 0,
-        SPITIM = 0,
-        GPIO3 = 0,
-        GPIO2 = 0,
-        GPIO1 = 0,
-        GPIO0 = 0)
-    print("Positive \t Negative \t Median (mV) \t Standard Deviation (uV)")
-    for measurement_pair in measurement_pairs:
+    if refreshed: # housekeeping reads move the mux, gain and reference, so put the measurement set-up back
+        setup(adc)
+        adc.PGA(BYPASS = 0, GAIN = gain)
+        adc.set_frequency(data_rate = data_rate, digital_filter = digital_filter, print_freq = False)
+        adc.mode3(PWDN = 0,
+            STATENB = 1,
+            CRCENB = 0,
+            SPITIM = 0,
+            GPIO3 = 0,
+            GPIO2 = 0,
+            GPIO1 = 0,
+            GPIO0 = 0)
+    CHOP, _, DELAY = adc.check_mode1()
+    discard = settling_conversions(data_rate, digital_filter, CHOP = CHOP, DELAY = DELAY, analog_settling = analog_settling)
+    if archive is not None:
+        archive.next_window(external_reference)
+    probes.lap('window set-up')
+    for pair, measurement_pair in enumerate(measurement_pairs):
         positive, negative = measurement_pair[0], measurement_pair[1]
-        median, standard_deviation = GaN_measurement(adc, positive, negative, external_reference, gain, window = window, status_byte = status_byte)
+        median, standard_deviation, count = GaN_measurement(adc, positive, negative, external_reference, gain, window = window, status_byte = status_byte, data_ready = data_ready, buffer = buffer, discard = discard, gain_table = gain_table, archive = archive, pair = pair, probes = probes, convergence = convergence)
         medians.append(median)
         standard_deviations.append(standard_deviation)
-        print(positive,'\t\t', negative,'\t\t', median,'\t\t', standard_deviation*1000)
+        samples.append(count)
         #~ adc.print_mode3()
         #~ print(adc.check_current())
-    temperature = adc.check_temperature()
-    print("Temperature (deg C):", temperature)
-    result_queue.put(("GaN", [external_reference, medians, standard_deviations, temperature]))
-    return 0
+    temperature = adc.check_temperature() if housekeeping is None else housekeeping.value('temperature') # cached: see housekeeping.py
+    probes.lap('check_temperature')
+    result = [external_reference, medians, standard_deviations, temperature]
+    if convergence is not None: # adaptive windows: conversions used by each pair
+        result.append(samples)
+    probes.since('multiplex', started)
+    if result_queue is not None:
+        result_queue.put(("GaN", result))
+    return result
     
-def commercial_pH(result_queue, connected = False):
-    if connected == True:
-        start = time.time()
-        commercial_pH = pH_meter.single_output()
-        while commercial_pH in [254, 254.0, str(254), str(254.0), 255, 255.0, str(255), str(255.0)]:
-            commercial_pH = pH_meter.single_output()
-            if commercial_pH not in [254, 254.0, str(254), str(254.0), 255, 255.0, str(255), str(255.0)]: # if its an error code, collect other measurements
-                result_queue.put(("commercial_pH", commercial_pH))
-            elif time.time() - start > 10: # if it's taken more than 10 seconds, there's a fault.
-                result_queue.put(("commercial_pH", "Timed out."))
-            else:
-                pass
-    else: # if it's not connected, wait 0.8 seconds anyway
-        time.sleep(0)
-        #~ time.sleep(0.8)
-        result_queue.put(("commercial_pH", "Not connected."))
-    return 0
-
-def write_to_csv(csv_file, fieldnames, measurement_date, measurement_time, GaN_sensor_result, commercial_pH_result, measurement_pairs):
+def write_to_csv(csv_sink, measurement_date, measurement_time, GaN_sensor_result, commercial_pH_result, measurement_pairs, start = None):
     ''' This function writes all the results to CSV. It requires the results to be 
         unpacked before submission. Would be good to remove the print requirement. '''
     #~ print(all_results)
-    external_reference, medians, standard_deviations, temperature = GaN_sensor_result
+    external_reference, medians, standard_deviations, temperature = GaN_sensor_result[:4]
     commercial_pH = commercial_pH_result
     
     row = [measurement_date, measurement_time, external_reference]
@@ -168,21 +189,39 @@ def write_to_csv(csv_file, fieldnames, measurement_date, measurement_time, GaN_s
         row.extend([median, standard_deviation*1000])
 
     row.extend([commercial_pH, temperature])
-    row = dict(zip(fieldnames, row))
+    if len(GaN_sensor_result) > 4 and GaN_sensor_result[4] is not None: # samples per pair from adaptive windows
+        row.extend(GaN_sensor_result[4])
+    if len(GaN_sensor_result) > 5: # the other boards' reference and temperature (see multi_board.py)
+        row.extend(GaN_sensor_result[5])
     try:
-        with open(csv_file, 'a') as csvfile:
-            # write each row
-            writer = csv.writer(csvfile)
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writerow(row)
-    except IOError:
-        print("Unable to save to csv")  
-    except KeyboardInterrupt:
-        adc.end()
-        csvfile.close()
+        csv_sink.write_row(row, start) # batched: see csv_sink.py
+    except IOError as e:
+        print("Unable to save to csv")
+        print(e)
 
     return 0    
     
+def write_to_binary_log(binary_log, start, GaN_sensor_result, commercial_pH_result, measurement_pairs):
+    ''' Appends the same values as write_to_csv() to the binary log (see binary_log.py). '''
+    external_reference, medians, standard_deviations, temperature = GaN_sensor_result[:4]
+
+    values = [external_reference]
+    for measurement_pair, median, standard_deviation in zip(measurement_pairs, medians, standard_deviations):
+        values.extend([median, standard_deviation*1000])
+
+    values.extend([commercial_pH_result, temperature])
+    if len(GaN_sensor_result) > 4 and GaN_sensor_result[4] is not None:
+        values.extend(GaN_sensor_result[4])
+    if len(GaN_sensor_result) > 5:
+        values.extend(GaN_sensor_result[5])
+    try:
+        binary_log.write(start, values)
+    except IOError as e:
+        print("Unable to save to binary log")
+        print(e)
+
+    return 0
+
 def main():
     # Change these parameters:
     window = 10
@@ -190,6 +229,24 @@ def main():
     constant_current, pin = '100', 'AIN4'
     gain = 1
     connected_pH_meter = False # set to true if connected
+    auto_gain = False # True replaces gain with a per-pair gain kept in gain_table_<script>.json, re-ranged after every window (see gain_table.py)
+    streaming_statistics = False # True keeps constant-memory statistics instead of storing each window (very long windows)
+    save_binary = False # True also appends every window to a compact .bin log next to the CSV (see binary_log.py)
+    save_raw = False # True also keeps every raw conversion in memory-mapped segments next to the CSV (see raw_archive.py)
+    rotate_output = False # True splits the CSV into size-capped, gzipped segments with an index file (see rotating_output.py)
+    status_interval = 1 # seconds between console status updates, None for headless runs (see status_display.py)
+    live_plot = False # True plots the results live in a separate process (see live_plot.py)
+    stream_port = None # e.g. 8765 streams every window to local clients as JSON lines (see stream_server.py)
+    additional_boards = [] # more ADS1261 boards scanned in parallel, e.g. [{'measurement_pairs': [['AIN2', 'AIN3']], 'drdy_pin': 5, 'driver': {...}}] (see multi_board.py)
+    orchestration = 'threads' # 'threads' for worker threads, 'asyncio' to run the ADC windows, pH probe, housekeeping reads and sinks as coroutines on one event loop (see async_runner.py), 'process' to run the ADC loop in its own process (see shared_ring.py)
+    acquisition = 'drdy' # 'drdy' waits for the data-ready edge, 'polling' spins on collect_measurement
+    standard_error_target = None # e.g. 0.001 (mV) or {'AIN2-AIN3': 0.0005, 'default': 0.002}: sample each pair until the standard error of its median reaches this, with window as the maximum (see convergence.py)
+    minimum_window = 5 # fewest conversions per pair when standard_error_target is set
+    temperature_interval = 60 # seconds between check_temperature() reads, 0 for every cycle (see housekeeping.py)
+    reference_interval = 60 # seconds between power_readback() reads (each followed by setup() and its 100 ms settle), 0 for every cycle
+    current_interval = None # seconds between check_current() reads, None to skip them
+    analog_settling = 0 # seconds the sensor needs to settle after each input change, read and discarded (see settling.py); 0 as before
+    instrument = False # True times every stage of the cycle; summary on exit or on kill -USR1 (see instrumentation.py)
        
     # forward measurement pairs
     measurement_pairs = [
@@ -205,6 +262,8 @@ def main():
     fieldnames = ['Date', 
         'Time', 
         'External Reference (mV with 10k resistor)',
+        'AIN0 to AIN1 (mV)',
+        'Standard deviation of AIN0 to AIN1 (uV)',
         'Sense Pad 1 (mV)', 
         'Standard deviation of Sense Pad 1 (uV)',
         'Between Sense Pad 1 and 2 (mV)',
@@ -219,6 +278,10 @@ def main():
         'Air Temperature from ADS1261 (deg C)']
         
     # Avoid changing the following parameters:
+    plot = None
+    if live_plot:
+        from live_plot import LivePlot
+        plot = LivePlot(measurement_pairs).start() # fork before the instruments are opened or any threads start
     adc, dac, pH_meter = initialise_instruments()
     reference = adc.power_readback()
     
@@ -230,6 +293,14 @@ def main():
         constant_current = constant_current,
         current_out_pin = pin)
     
+    board_one_pairs = measurement_pairs
+    if additional_boards:
+        from multi_board import Board, BoardManager, open_boards, merged_layout, board_columns
+        measurement_pairs, fieldnames = merged_layout(measurement_pairs, fieldnames, additional_boards, insert_at = len(fieldnames) - 2) # extra boards' columns go before pH and temperature
+    if standard_error_target is not None: # adaptive windows also record how many conversions each pair used
+        fieldnames = fieldnames + ['Samples of ' + str(positive) + '-' + str(negative) for positive, negative in measurement_pairs]
+    if additional_boards: # then each extra board's own reference and temperature
+        fieldnames = fieldnames + board_columns(additional_boards)
     #~ gain = check_maximum_gain(adc, measurement_pairs)
     
     print("Chosen maximum gain:", gain)
@@ -251,12 +322,28 @@ def main():
     csv_file = "/home/pi/Documents/Results/"+measurement_date+measurement_time+".csv"
 
     try:
-        with open(csv_file, 'w') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-        print("CSV File successfully created", csv_file)
-    except IOError:
+        if rotate_output:
+            from rotating_output import RotatingCSVSink
+            csv_sink = RotatingCSVSink(csv_file, fieldnames, max_bytes = 4*1024**2, keep_segments = None, flush_rows = 20, flush_interval = 30, fsync = 'flush')
+        else:
+            csv_sink = CSVSink(csv_file, fieldnames, flush_rows = 20, flush_interval = 30, fsync = 'flush') # one open file, rows written in batches
+        print("CSV File successfully created", csv_sink.path)
+    except IOError as e:
         print("Unable to save to csv")
+        print(e)
+        return 1
+    binary_log = None
+    if save_binary:
+        from binary_log import BinaryLog
+        binary_log = BinaryLog(csv_file[:-len('.csv')] + '.bin', fieldnames[2:], gain = gain, reference = reference, measurement_pairs = measurement_pairs, time_separator = ':')
+    archive = None
+    if save_raw and not streaming_statistics:
+        from raw_archive import RawArchive
+        archive = RawArchive(csv_file[:-len('.csv')] + '_raw', board_one_pairs, data_rate = data_rate) # streaming statistics keep no codes
+    probes = no_probes
+    if instrument:
+        from instrumentation import Probes
+        probes = Probes().install(csv_file[:-len('.csv')] + '_timing.json') # stage timings (see instrumentation.py)
 
     _, STATENB_status, _, _, _, _, _, _ = adc.check_mode3()
     if STATENB_status == "No Status byte":
@@ -264,64 +351,167 @@ def main():
     else: 
         status_byte = "enabled"
     print("Status byte:", status_byte)
-    flag = 0
-    while(1):        
-        try:
-            start = time.time()
-            q = queue.Queue()
+    data_ready = DataReady(adc) if acquisition == 'drdy' else None
+    if streaming_statistics: # the buffer is reused by every pair on every cycle
+        from streaming_stats import StreamingWindow
+        buffer = StreamingWindow(window)
+    else:
+        buffer = WindowBuffer(window)
+    gain_table = None
+    if auto_gain:
+        from gain_table import GainTable, gain_table_path
+        gain_table = GainTable(gain_table_path(__file__))
+    def board_housekeeping(board_adc):
+        return Housekeeping().add('reference', board_adc.power_readback, interval = reference_interval).add('temperature', board_adc.check_temperature, interval = temperature_interval).add('current', board_adc.check_current, interval = current_interval)
+    housekeeping = board_housekeeping(adc)
+    convergence = None
+    if standard_error_target is not None:
+        from convergence import Convergence
+        convergence = Convergence(standard_error_target, minimum = minimum_window)
+    raw_ring = None
+    if orchestration == 'process':
+        from shared_ring import SharedRing, AcquisitionProcess, RingWorker, RingArchive, ArchiveWorker, result_size, raw_slot_size
+    if orchestration == 'process' and archive is not None: # the codes come back through shared memory and are archived here
+        raw_ring = SharedRing(slots = 8*(len(board_one_pairs) + 1), slot_size = raw_slot_size(window))
+    acquire = functools.partial(multiplex, adc, board_one_pairs, None, gain, reference, window, status_byte, data_rate, digital_filter,
+        data_ready = data_ready, buffer = buffer, gain_table = gain_table, archive = RingArchive(raw_ring) if raw_ring is not None else archive, probes = probes, housekeeping = housekeeping, convergence = convergence, analog_settling = analog_settling)
+    manager = None
+    if additional_boards: # every board runs its own multiplex() at the same time
+        def board_acquire(board_adc, pairs, board_data_ready, name):
+            return functools.partial(multiplex, board_adc, pairs, None, gain, reference, window, status_byte, data_rate, digital_filter,
+                data_ready = board_data_ready, buffer = StreamingWindow(window) if streaming_statistics else WindowBuffer(window),
+                gain_table = GainTable(gain_table_path(__file__, name)) if auto_gain else None, probes = probes, housekeeping = board_housekeeping(board_adc), convergence = convergence, analog_settling = analog_settling)
+        manager = BoardManager([Board('Board 1', adc, board_one_pairs, acquire)] + open_boards(ads1261, additional_boards, board_acquire,
+            setup = functools.partial(setup, adc_frequency = data_rate, digital_filter = digital_filter, BYPASS = 0, gain = gain, constant_current = constant_current, current_out_pin = pin),
+            use_drdy = acquisition == 'drdy'))
+        acquire = manager.scan
+    ring, acquisition_process = None, None
+    if orchestration == 'process': # only the ADC loop runs in the acquisition process; writers, display and analysis stay here
+        ring = SharedRing(slots = 64, slot_size = result_size(len(measurement_pairs), 2*len(additional_boards)))
+        acquisition_process = AcquisitionProcess(acquire, ring, probes).start() # fork before any threads start
+    server = None
+    if stream_port is not None:
+        from stream_server import StreamServer, window_record
+        server = StreamServer(port = stream_port).start()
+    status = StatusDisplay(window_table, interval = status_interval).start() # prints from its own thread, never from acquisition
+    pH_poller = None
+    if connected_pH_meter:
+        from pH_poller import PHPoller
+        pH_poller = PHPoller(pH_meter) # keeps the latest pH so acquisition never waits on the probe
+        if orchestration != 'asyncio': # the asyncio runner polls it from a coroutine instead
+            pH_poller.start()
 
-            commercial_pH_thread = threading.Thread(target = commercial_pH, args=(q, connected_pH_meter))
-            GaN_sensor_thread = threading.Thread(target = multiplex, args=(adc, measurement_pairs, q, gain, reference, window, status_byte, data_rate, digital_filter))
-            
-            threads = [commercial_pH_thread, GaN_sensor_thread]
-            
-            for thread in threads:
-                thread.daemon = True
-                thread.start() # start the threads running
-            
-            # Get timestamp data while the threads are running.
-            timestamp, measurement_date, measurement_time = None, None, None # clear previous values (just in case!)    
-            timestamp = datetime.now()
-            measurement_date = str(timestamp.year)+'-'+str(timestamp.month)+'-'+str(timestamp.day)
-            measurement_time = str(timestamp.hour)+':'+str(timestamp.minute)+':'+str(timestamp.second)+'.'+str(timestamp.microsecond)
-            if flag > 0: csv_thread.join() # what if I put this with the other threads?
-            for thread in threads:
-                thread.join() # wait until all the threads are completed before accessing results
-            
-            # Sometimes the results come in a different order in the queue, so you can't depend on 
-            #   when the results arrive to be indicative of where the results came from. 
-            #   Therefore, get all results into a list.
-            results = []
-            while not q.empty():
-                results.append(q.get())
-            #   Then search the all queued results for the name given in the functions above.
-            #~ print("Results (raw):", results)
-            for element in results:
-                if 'GaN' in element[0]:
-                    GaN_sensor_result = element[1]
-                    if type(GaN_sensor_result) != list:
-                        GaN_sensor_result = list(GaN_sensor_result)
-                    
-                elif 'commercial_pH' in element[0]:
-                    commercial_pH_result = element[1]
-                else:
-                    pass
-            
-            csv_thread = threading.Thread(target = write_to_csv, args=(csv_file, fieldnames, measurement_date, measurement_time, GaN_sensor_result, commercial_pH_result, measurement_pairs))
-            csv_thread.start()
-                        
-            # Could be a good spot to print current results.
-            print("Commercial pH result:", commercial_pH_result)
-            #~ print("GaN result:", GaN_sensor_result)
-            print("Total time taken:", time.time() - start)   
+    def housekeeping_notes():
+        if orchestration == 'process' or additional_boards: # the cached reads live in the acquisition process or with each board
+            return []
+        return [(name.capitalize() + " read (s ago)", round(age, 1) if age is not None else None) for name, age in housekeeping.ages().items() if housekeeping.reads[name][1] is not None]
+
+    if orchestration == 'asyncio':
+        import asyncio # only this mode needs the event loop
+        from async_runner import AsyncRunner
+        def write_row(start, result):
+            measurement_date, measurement_time = get_experiment_time(datetime.fromtimestamp(start))
+            commercial_pH_result = pH_poller.value() if pH_poller is not None else "Not connected."
+            write_to_csv(csv_sink, measurement_date, measurement_time, result, commercial_pH_result, measurement_pairs, start)
+        def write_record(start, result):
+            commercial_pH_result = pH_poller.value() if pH_poller is not None else "Not connected."
+            write_to_binary_log(binary_log, start, result, commercial_pH_result, measurement_pairs)
+        def show_status(start, result):
+            external_reference, medians, standard_deviations, temperature = result[:4]
+            samples = result[4] if len(result) > 4 else None
+            commercial_pH_result = pH_poller.value() if pH_poller is not None else "Not connected."
+            status.publish(measurement_pairs, medians, standard_deviations, temperature, [("Commercial pH result", commercial_pH_result)] + ([("Samples per pair", samples)] if samples is not None else []) + housekeeping_notes())
+            if plot is not None:
+                plot.publish(start, medians, temperature, commercial_pH_result)
+            if server is not None:
+                server.publish(window_record(start, measurement_pairs, medians, standard_deviations, temperature, reference = external_reference, pH = commercial_pH_result, samples = samples))
+        runner = AsyncRunner(acquire,
+            [probes.timed('write_to_csv', write_row), show_status] + ([probes.timed('write_to_binary_log', write_record)] if binary_log is not None else []),
+            pH_poller = pH_poller, housekeeping = None if additional_boards else housekeeping) # each extra board refreshes its own
+        try:
+            asyncio.run(runner.run())
         except KeyboardInterrupt:
+            print("Stopping: writing the remaining results.")
+        finally:
+            csv_sink.close()
+            if binary_log is not None:
+                binary_log.close()
+            if archive is not None:
+                archive.close()
+            if pH_poller is not None:
+                pH_poller.stop()
+            if manager is not None:
+                manager.close()
+            if plot is not None:
+                plot.stop()
+            if server is not None:
+                server.stop()
+            status.stop()
             adc.end()
-        except Exception as e:
-            print("Error in constant current program")
-            print(e)
-            
-    flag = 1 
-    
+        return 0
+
+    # One long-lived thread per job, connected by bounded queues.
+    stop = threading.Event()
+    results = queue.Queue(maxsize = 8)
+    rows = queue.Queue(maxsize = 64)
+    records = queue.Queue(maxsize = 64)
+    if acquisition_process is not None:
+        GaN_sensor_worker = RingWorker('GaN', ring.reader(), results, stop)
+    else:
+        GaN_sensor_worker = LoopWorker('GaN', acquire, results, stop)
+    csv_worker = WriterWorker('csv', probes.timed('write_to_csv', functools.partial(write_to_csv, csv_sink)), rows, stop)
+    workers = [GaN_sensor_worker, csv_worker]
+    if raw_ring is not None:
+        workers.append(ArchiveWorker(raw_ring.reader(), archive, stop))
+    if binary_log is not None:
+        workers.append(WriterWorker('binary', probes.timed('write_to_binary_log', functools.partial(write_to_binary_log, binary_log)), records, stop))
+    for worker in workers:
+        worker.start()
+
+    previous_start = None
+    try:
+        while(1):
+            name, start, result = results.get()
+            measurement_date, measurement_time = get_experiment_time(datetime.fromtimestamp(start)) # when this cycle's measurements started
+            commercial_pH_result = pH_poller.value() if pH_poller is not None else "Not connected."
+            put(rows, (measurement_date, measurement_time, result, commercial_pH_result, measurement_pairs, start), stop)
+            if binary_log is not None:
+                put(records, (start, result, commercial_pH_result, measurement_pairs), stop)
+
+            external_reference, medians, standard_deviations, temperature = result[:4]
+            samples = result[4] if len(result) > 4 else None
+            status.publish(measurement_pairs, medians, standard_deviations, temperature, [("Commercial pH result", commercial_pH_result), ("Total time taken", start - previous_start if previous_start is not None else None)] + ([("Samples per pair", samples)] if samples is not None else []) + housekeeping_notes())
+            if plot is not None:
+                plot.publish(start, medians, temperature, commercial_pH_result)
+            if server is not None:
+                server.publish(window_record(start, measurement_pairs, medians, standard_deviations, temperature, reference = external_reference, pH = commercial_pH_result, samples = samples))
+            previous_start = start
+    except KeyboardInterrupt:
+        print("Stopping: finishing the current cycle and writing the remaining results.")
+    finally:
+        if acquisition_process is not None:
+            acquisition_process.stop()
+        shutdown(workers, stop)
+        csv_sink.close()
+        if binary_log is not None:
+            binary_log.close()
+        if archive is not None:
+            archive.close()
+        if pH_poller is not None:
+            pH_poller.stop()
+        if manager is not None:
+            manager.close()
+        if plot is not None:
+            plot.stop()
+        if server is not None:
+            server.stop()
+        status.stop()
+        if ring is not None:
+            ring.close()
+        if raw_ring is not None:
+            raw_ring.close()
+        adc.end()
+
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+'''
+#~ Adaptive window length from the standard error.
+
+With a fixed window, a quiet pair is sampled for as long as a noisy one. A
+Convergence gives each pair a standard-error target (mV) instead: the
+window reader keeps collecting until the standard error of the window's
+median (or mean) is at or below the target, or until the buffer's window
+(now the maximum) is full. The minimum count guards against stopping on a
+few conversions that happen to agree.
+
+The standard error is estimated from the running variance of the raw codes,
+kept by streaming_stats.RunningStatistics (one update per conversion):
+
+mean      s / sqrt(n)
+median    sqrt(pi/2) * s / sqrt(n), its large-sample value for normal noise
+
+Targets are one number for every pair, or a dict keyed by 'positive-negative'
+(e.g. 'AIN2-AIN3') with an optional 'default'. A pair with no target is read
+for the full window.
+
+'''
+
+import math
+from streaming_stats import RunningStatistics
+
+statistic_factors = {'mean': 1.0, 'median': math.sqrt(math.pi/2)}
+
+class StandardErrorStop(object):
+    ''' Called with every new code by WindowBuffer.read()/StreamingWindow.read(). Returns True once the window has converged. '''
+
+    def __init__(self, target, scale, minimum = 10, statistic = 'median'):
+        # se^2 = factor^2 * variance / n <= target^2, with everything in codes
+        self.limit = (target / (scale * statistic_factors[statistic]))**2
+        self.minimum = max(minimum, 2)
+        self.statistics = RunningStatistics()
+
+    def __call__(self, code):
+        statistics = self.statistics
+        statistics.update(code)
+        return statistics.count >= self.minimum and statistics.variance() <= self.limit * statistics.count
+
+class Convergence(object):
+    ''' Per-pair standard-error targets (mV) for adaptive windows. '''
+
+    def __init__(self, targets, minimum = 10, statistic = 'median'):
+        if statistic not in statistic_factors:
+            raise ValueError("statistic must be one of " + ', '.join(statistic_factors))
+        self.targets = targets
+        self.minimum = minimum
+        self.statistic = statistic
+
+    def target(self, positive, negative):
+        if isinstance(self.targets, dict):
+            return self.targets.get(str(positive) + '-' + str(negative), self.targets.get('default'))
+        return self.targets
+
+    def rule(self, positive, negative, reference, gain):
+        ''' A fresh StandardErrorStop for one window of this pair, or None to read the full window. '''
+        target = self.target(positive, negative)
+        if target is None:
+            return None
+        return StandardErrorStop(target, float(reference) / (gain * 2**23), self.minimum, self.statistic)
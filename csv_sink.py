@@ -0,0 +1,84 @@
+'''
+#~ Buffered CSV output.
+
+Reopening the results file, building a csv.DictWriter and a dict for every
+row means an open/close (and a flash write) per measurement on the SD card
+or USB stick. CSVSink opens the file once, reuses one csv.writer, keeps rows
+in memory and writes them out in batches:
+
+flush_rows      write once this many rows are waiting
+flush_interval  ... or once the oldest waiting row is this many seconds old
+fsync           'flush' to fsync after every batch, 'close' only when the
+                file is closed, 'never' to leave it to the OS
+
+The file contents are the same as before: one header row, then one row per
+measurement. A row that is not as wide as the fieldnames raises ValueError
+rather than shifting values into the wrong columns.
+
+'''
+
+import os, csv, time, threading
+
+fsync_policies = ['flush', 'close', 'never']
+
+class CSVSink(object):
+    ''' Keeps one CSV file open and writes rows to it in batches. '''
+
+    def __init__(self, path, fieldnames, flush_rows = 20, flush_interval = 30, fsync = 'flush', mode = 'w'):
+        if fsync not in fsync_policies:
+            raise ValueError("fsync must be one of " + str(fsync_policies))
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.pending = []
+        self.oldest = None
+        self.rows_written = 0
+        self.csvfile = open(path, mode, newline = '')
+        self.writer = csv.writer(self.csvfile)
+        if self.csvfile.tell() == 0:
+            self.writer.writerow(self.fieldnames)
+            self._sync(self.fsync != 'never')
+
+    def write_row(self, row, start = None):
+        ''' Queues one row (a list in fieldname order) and flushes if the batch is due.
+            start is accepted for RotatingCSVSink's index and not used here. '''
+        if len(row) != len(self.fieldnames):
+            raise ValueError("Row has " + str(len(row)) + " values for " + str(len(self.fieldnames)) + " columns")
+        with self.lock:
+            self.pending.append(list(row))
+            if self.oldest is None:
+                self.oldest = time.time()
+            if len(self.pending) >= self.flush_rows or time.time() - self.oldest >= self.flush_interval:
+                self._flush()
+        return 0
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+        return 0
+
+    def _flush(self):
+        if not self.pending:
+            return
+        self.writer.writerows(self.pending)
+        self.rows_written += len(self.pending)
+        self.pending = []
+        self.oldest = None
+        self._sync(self.fsync == 'flush')
+
+    def _sync(self, fsync):
+        self.csvfile.flush()
+        if fsync:
+            os.fsync(self.csvfile.fileno())
+
+    def close(self):
+        with self.lock:
+            if self.csvfile.closed:
+                return 0
+            self._flush()
+            self._sync(self.fsync != 'never')
+            self.csvfile.close()
+        return 0
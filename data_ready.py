@@ -0,0 +1,45 @@
+'''
+#~ DRDY-driven acquisition for the ADS1261.
+
+Instead of spinning on collect_measurement() until a float comes back, wait
+for the falling edge on the ADS1261 DRDY line (with a timeout) and read
+exactly one conversion per edge. The thread sleeps in the kernel between
+conversions, so the pH and CSV threads get the GIL back.
+
+On the Pi the edge is taken from RPi.GPIO. Backends that can signal DRDY
+themselves (e.g. instrument_backend.SimulatedADC1261) provide wait_for_drdy()
+and are used directly.
+
+'''
+
+# BCM pin wired to the ADS1261EVM DRDY output (active low).
+drdy_pin = 6
+
+class DataReady(object):
+    ''' Waits for the ADS1261 to signal a new conversion. '''
+
+    def __init__(self, adc, pin = drdy_pin):
+        self.adc = adc
+        self.pin = pin
+        self.GPIO = None
+        if not hasattr(adc, 'wait_for_drdy'):
+            import RPi.GPIO as GPIO
+            if GPIO.getmode() is None:
+                GPIO.setmode(GPIO.BCM)
+            GPIO.setup(pin, GPIO.IN)
+            self.GPIO = GPIO
+
+    def wait(self, timeout = 1.0):
+        ''' Blocks until DRDY goes low. Returns False if timeout (s) passes first. '''
+        if self.GPIO is None:
+            return self.adc.wait_for_drdy(timeout = timeout)
+        if self.GPIO.input(self.pin) == 0: # a conversion is already waiting to be read
+            return True
+        return self.GPIO.wait_for_edge(self.pin, self.GPIO.FALLING, timeout = int(timeout * 1000)) is not None
+
+def collect_conversion(adc, data_ready = None, reference = 5000, gain = 1, status = 'enabled', bits = False, timeout = 1.0):
+    ''' Reads one conversion. With a DataReady, waits for the DRDY edge first and raises
+        TimeoutError if no conversion arrives; without one, falls back to polling. '''
+    if data_ready is not None and not data_ready.wait(timeout = timeout):
+        raise TimeoutError("No DRDY from the ADS1261 within " + str(timeout) + " s")
+    return adc.collect_measurement(method = 'hardware', reference = reference, gain = gain, status = status, bits = bits)
@@ -1,47 +1,103 @@
+#!/usr/bin/env python3
+'''
 #~ datalogger.py
 
-import sys
-
-path_to_ads1261evm = "/home/pi/Documents/ads1261evm/"
-path_to_dac7562evm = "/home/pi/Documents/dac7562evm/"
-path_to_AS_pH_meter = "/home/pi/Documents/AtlasScientific_pHmeter"
-
-sys.path.insert(0,path_to_ads1261evm)
-sys.path.insert(0,path_to_dac7562evm)
-sys.path.insert(0,path_to_AS_pH_meter)
-
-import ads1261evm as ads1261
-import dac7562evm as dac7562
-import AtlasScientific_pHmeter as pH_probe
-
-import numpy as np
-import matplotlib.pyplot as plt
-import time
-import statistics
-
-
-# set up DAC & ADC (frequency, etc)
-# set constant 100 uA current from ADC, then measure
-# set voltage
-# measure potential and record with timestamp (threads)
-# measure pH (non-blocking)
-	while(1):
-		start_time = time.time()
-		try:
-			pH = device.query("R")[:5]
-			print(len(pH), pH)
-			print(type(pH))
-			try:
-				pH = float(pH)
-				print(type(pH), pH)			
-			except KeyboardInterrupt:
-				device.close()
-				sys.exit()
-			
-		except KeyboardInterrupt:
-			device.close()
-			sys.exit()
-		end_time = time.time()
-		print("Query time:", end_time - start_time)
-# record to csv
-# repeat
+One command for every measurement mode:
+
+python3 datalogger.py constant-current      constant_current.py
+python3 datalogger.py constant-current-no-pH constant_current_no_pH.py
+python3 datalogger.py 2-wire                constant_current_2_wire.py
+python3 datalogger.py ac                    AC_measurement.py
+python3 datalogger.py external-ac           AC_external_constant_current.py
+python3 datalogger.py array                 array_constant_100uA.py
+python3 datalogger.py single-pad            jianan_constant_100uA.py
+
+Only the standard library is imported here. The chosen mode's script, and
+with it numpy and the instrument drivers it needs, is imported once the mode
+is known, so the other modes' drivers are never touched. Add --simulated to
+run on the simulated ADS1261 (see instrument_backend.py).
+
+python3 datalogger.py benchmark-startup [mode ...] [--repeats 5] [--simulated]
+starts a fresh interpreter for each mode that only imports it, and reports
+the median wall time next to a bare interpreter start. Without --simulated
+this times the real ads1261evm, dac7562evm and Atlas Scientific imports.
+
+'''
+
+import os, sys, time, argparse, importlib, subprocess
+
+modes = {
+    'constant-current': ('constant_current', 'constant current with the pH probe, averaged between CSV writes'),
+    'constant-current-no-pH': ('constant_current_no_pH', 'constant current, windowed medians (pH probe optional)'),
+    '2-wire': ('constant_current_2_wire', '2-wire constant current'),
+    'ac': ('AC_measurement', 'ADS1261 AC excitation'),
+    'external-ac': ('AC_external_constant_current', 'external AC constant current source'),
+    'array': ('array_constant_100uA', '100 uA across the three-pad array'),
+    'single-pad': ('jianan_constant_100uA', '100 uA across a single pad'),
+}
+
+def load_mode(mode):
+    ''' Imports the script behind mode and returns the module. '''
+    return importlib.import_module(modes[mode][0])
+
+def run_mode(mode, simulated = False):
+    if simulated:
+        os.environ['DATALOGGER_BACKEND'] = 'simulated' # read by instrument_backend when the script is imported
+    return load_mode(mode).main()
+
+def startup_time(arguments, repeats = 5):
+    ''' Median wall time (s) of running this interpreter with arguments, and whether every run succeeded. '''
+    times, succeeded = [], True
+    for repeat in range(repeats):
+        started = time.perf_counter()
+        completed = subprocess.run([sys.executable] + arguments, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+        times.append(time.perf_counter() - started)
+        if completed.returncode != 0:
+            succeeded = False
+            error = completed.stderr.decode(errors = 'replace').strip().splitlines()
+            print("   ", error[-1] if error else "exit code " + str(completed.returncode))
+            break
+    times.sort()
+    return times[len(times)//2], succeeded
+
+def benchmark_startup(selected = None, repeats = 5, simulated = False):
+    selected = selected or list(modes)
+    if simulated:
+        os.environ['DATALOGGER_BACKEND'] = 'simulated' # inherited by every timed interpreter
+    baseline, _ = startup_time(['-c', 'pass'], repeats)
+    print("Backend:", os.environ.get('DATALOGGER_BACKEND', 'hardware'))
+    print("Interpreter start (s):", round(baseline, 3))
+    print("Mode \t\t\t Startup (s) \t Imports (s)")
+    for mode in selected:
+        elapsed, succeeded = startup_time([os.path.abspath(__file__), mode, '--import-only'], repeats)
+        if succeeded:
+            print(mode.ljust(24), '\t', round(elapsed, 3), '\t\t', round(elapsed - baseline, 3))
+        else:
+            print(mode.ljust(24), '\t', "failed to import")
+    return 0
+
+def main(arguments = None):
+    parser = argparse.ArgumentParser(description = "GaN sensor datalogger")
+    parser.add_argument('mode', choices = list(modes) + ['benchmark-startup'], help = "measurement mode to run")
+    parser.add_argument('modes', nargs = '*', help = "modes to time with benchmark-startup (default: all)")
+    parser.add_argument('--simulated', action = 'store_true', help = "use the simulated ADS1261")
+    parser.add_argument('--repeats', type = int, default = 5, help = "runs per mode for benchmark-startup")
+    parser.add_argument('--import-only', action = 'store_true', help = argparse.SUPPRESS)
+    arguments = parser.parse_args(arguments)
+
+    if arguments.mode == 'benchmark-startup':
+        unknown = [mode for mode in arguments.modes if mode not in modes]
+        if unknown:
+            parser.error("unknown modes: " + ', '.join(unknown))
+        return benchmark_startup(arguments.modes, arguments.repeats, arguments.simulated)
+    if arguments.modes:
+        parser.error("unexpected arguments: " + ' '.join(arguments.modes))
+    if arguments.import_only:
+        if arguments.simulated:
+            os.environ['DATALOGGER_BACKEND'] = 'simulated'
+        load_mode(arguments.mode)
+        return 0
+    return run_mode(arguments.mode, arguments.simulated)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+'''
+#~ Per-pair PGA gain table.
+
+check_maximum_gain() applies the smallest of every pair's maximum gain to
+all pairs, so one large signal costs every other pad its resolution. A
+GainTable keeps the best gain for each measurement pair, probes it once with
+adc.maximum_gain(), and saves it to a JSON file so later runs start from the
+known gains. After every window the pair is re-ranged from its largest raw
+code:
+
+- within headroom of full scale, the pair is re-probed; if the probe does
+  not suggest a lower gain, the gain is stepped down one setting,
+- below step_up of full scale for patience windows in a row, the gain is
+  stepped up one setting (step_up is under half the headroom, so the
+  doubled signal still fits), so a transient does not pin a pair low.
+
+The scripts measure different sensors on the same pins, so each keeps its
+own file, gain_table_path(__file__), and each extra board its own again.
+
+'''
+
+import os, json
+
+gains = [1, 2, 4, 8, 16, 32, 64, 128]
+full_scale_code = 2**23
+
+def gain_table_path(script, board = None):
+    ''' gain_table_<script>[_<board>].json next to this file. '''
+    name = os.path.splitext(os.path.basename(script))[0]
+    if board is not None:
+        name += '_' + board.replace(' ', '_')
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gain_table_' + name + '.json')
+
+class GainTable(object):
+    ''' Maps "positive-negative" pairs to their PGA gain. '''
+
+    def __init__(self, path, headroom = 0.9, step_up = 0.4, patience = 3):
+        self.path = path
+        self.headroom = headroom
+        self.step_up = step_up
+        self.patience = patience
+        self.gains = {}
+        self.quiet = {} # pair -> windows in a row below step_up
+        try:
+            with open(path, 'r') as gain_file:
+                saved = json.load(gain_file)
+        except IOError:
+            saved = {}
+        except ValueError as e:
+            print("Ignoring unreadable gain table", path)
+            print(e)
+            saved = {}
+        if not isinstance(saved, dict):
+            print("Ignoring unreadable gain table", path)
+            saved = {}
+        for key, gain in saved.items(): # a hand-edited or stale file may hold gains the PGA does not have
+            if gain in gains:
+                self.gains[key] = gain
+            else:
+                print("Ignoring gain", gain, "for", key, "in", path)
+
+    @staticmethod
+    def key(positive, negative):
+        return str(positive) + '-' + str(negative)
+
+    def save(self):
+        try:
+            with open(self.path, 'w') as gain_file:
+                json.dump(self.gains, gain_file, indent = 4, sort_keys = True)
+        except IOError as e:
+            print("Unable to save gain table")
+            print(e)
+        return 0
+
+    def probe(self, adc, positive, negative):
+        ''' Asks the ADC for the largest gain this pair can use and stores it. '''
+        gain = adc.maximum_gain(positive_input = positive, negative_input = negative)
+        self.gains[self.key(positive, negative)] = gain
+        self.save()
+        return gain
+
+    def gain(self, adc, positive, negative):
+        ''' The gain for this pair, probing the ADC the first time the pair is seen. '''
+        gain = self.gains.get(self.key(positive, negative))
+        if gain is None:
+            gain = self.probe(adc, positive, negative)
+        return gain
+
+    def check(self, adc, positive, negative, peak_code):
+        ''' Re-ranges the pair from the largest raw code of its last window.
+            Returns True if the gain changed. '''
+        key = self.key(positive, negative)
+        current = self.gain(adc, positive, negative)
+        if peak_code >= self.headroom * full_scale_code:
+            self.quiet[key] = 0
+            gain = adc.maximum_gain(positive_input = positive, negative_input = negative)
+            if gain >= current:
+                gain = gains[max(gains.index(current) - 1, 0)]
+        elif peak_code < self.step_up * full_scale_code and current < gains[-1]:
+            self.quiet[key] = self.quiet.get(key, 0) + 1
+            if self.quiet[key] < self.patience:
+                return False
+            self.quiet[key] = 0
+            gain = gains[gains.index(current) + 1]
+        else:
+            self.quiet[key] = 0
+            return False
+        if gain == current:
+            return False
+        print("Gain for", positive, negative, "changed from", current, "to", gain)
+        self.gains[key] = gain
+        self.save()
+        return True
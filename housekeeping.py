@@ -0,0 +1,104 @@
+'''
+#~ Decimated housekeeping reads for the ADS1261.
+
+check_temperature(), power_readback() and check_current() each move the
+mux, gain and reference to take their reading, and power_readback() is
+followed in constant_current_no_pH.py by setup(adc) with its 100 ms
+reference settle. Done on every cycle, that is time the sensor pairs are
+not being measured, for values that change over minutes.
+
+Housekeeping keeps a list of such reads, each with its own interval.
+multiplex() calls refresh() once per cycle, on the thread that owns the
+ADC, and only the reads that are due are made; refresh() returns True when
+any read was made, so the caller knows to put the measurement set-up back.
+Every other cycle uses the cached values. value(name) is the last reading,
+and age(name) is how many seconds old it is.
+
+An interval of 0 reads every cycle (the old behaviour); None never reads.
+
+With scheduled set, the reads are made by someone else calling read_due()
+on the ADC's thread between windows (async_runner.AsyncRunner does, from
+its own coroutine), and refresh() only reports whether any were made since
+it was last called.
+
+Usage:
+housekeeping = Housekeeping()
+housekeeping.add('temperature', adc.check_temperature, interval = 60)
+housekeeping.add('reference', adc.power_readback, interval = 60)
+...
+if housekeeping.refresh():
+    setup(adc)
+temperature = housekeeping.value('temperature')
+
+'''
+
+import time
+
+class Housekeeping(object):
+    ''' Slow ADC reads refreshed at their own intervals, with the last value and its time. '''
+
+    def __init__(self):
+        self.reads = {} # name -> (read, interval)
+        self.readings = {} # name -> (time.time() of the reading, value)
+        self.scheduled = False # True when read_due() is called for us (see async_runner.py)
+        self.used = False # the ADC was used since refresh() last reported it
+
+    def add(self, name, read, interval = 60):
+        self.reads[name] = (read, interval)
+        return self
+
+    def due(self, name, now = None):
+        read, interval = self.reads[name]
+        if interval is None:
+            return False
+        if name not in self.readings:
+            return True
+        return (time.time() if now is None else now) - self.readings[name][0] >= interval
+
+    def next_due(self):
+        ''' Seconds until the next read is due (0 if one is due now), or None if none ever is. '''
+        now = time.time()
+        waits = []
+        for name, (read, interval) in self.reads.items():
+            if interval is None:
+                continue
+            if name not in self.readings:
+                return 0
+            waits.append(max(self.readings[name][0] + interval - now, 0))
+        return min(waits) if waits else None
+
+    def refresh(self):
+        ''' Makes every read that is due, or with scheduled set only reports the reads read_due()
+            made since the last call. Returns True if the ADC was used. '''
+        if self.scheduled:
+            used, self.used = self.used, False
+            return used
+        return self.read_due()
+
+    def read_due(self):
+        ''' Makes every read that is due. Returns True if the ADC was used. '''
+        now = time.time()
+        used = False
+        for name, (read, interval) in self.reads.items():
+            if not self.due(name, now):
+                continue
+            used = True
+            try:
+                self.readings[name] = (time.time(), read())
+            except Exception as e: # keep the previous value; try again next cycle
+                print("Unable to read", name)
+                print(e)
+        self.used = self.used or used
+        return used
+
+    def value(self, name, default = None):
+        reading = self.readings.get(name)
+        return default if reading is None else reading[1]
+
+    def age(self, name):
+        ''' Seconds since name was last read, or None if it never has been. '''
+        reading = self.readings.get(name)
+        return None if reading is None else time.time() - reading[0]
+
+    def ages(self):
+        return {name: self.age(name) for name in self.reads}
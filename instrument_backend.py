@@ -0,0 +1,352 @@
+'''
+#~ Instrument backends for the datalogger scripts.
+
+The scripts only ever talk to the ADS1261 through a handful of driver calls
+(choose_inputs, start1, stop, collect_measurement, check_temperature,
+power_readback, PGA, set_frequency, mode1/2/3, ...). This module lists
+that surface in adc_calls and provides two implementations:
+
+hardware        the ads1261evm.ADC1261 driver, imported from the Pi's sys.path
+simulated       SimulatedADC1261, an in-process ADS1261 that honours the
+                configured data rate, digital filter and conversion delay
+
+The dac7562evm and Atlas Scientific pH drivers are chosen the same way,
+by load_dac() and load_pH_probe().
+
+Choose the backend with the DATALOGGER_BACKEND environment variable, e.g.:
+DATALOGGER_BACKEND=simulated python3 array_constant_100uA.py
+
+'''
+
+import os, sys, time, random, threading, importlib
+
+path_to_ads1261evm = "/home/pi/Documents/ads1261evm/"
+path_to_dac7562evm = "/home/pi/Documents/dac7562evm/"
+path_to_AS_pH_meter = "/home/pi/Documents/AtlasScientific_pHmeter"
+
+# ADS1261 data sheet, 9.6.1 (MODE0) and 9.6.2 (MODE1).
+data_rates = [2.5, 5, 10, 16.6, 20, 50, 60, 100, 400, 1200, 2400, 4800, 7200, 14400, 19200, 25600, 40000]
+digital_filters = ['sinc1', 'sinc2', 'sinc3', 'sinc4', 'FIR']
+gains = [1, 2, 4, 8, 16, 32, 64, 128]
+conversion_delays = {'0us': 0, '50us': 50e-6, '59us': 59e-6, '67us': 67e-6, '85us': 85e-6,
+                    '119us': 119e-6, '189us': 189e-6, '328us': 328e-6, '605us': 605e-6,
+                    '1.16ms': 1.16e-3, '2.27ms': 2.27e-3, '4.49ms': 4.49e-3, '8.93ms': 8.93e-3, '17.8ms': 17.8e-3}
+
+# Number of conversion periods each filter needs before its output is fully settled.
+filter_settling_periods = {'sinc1': 1, 'sinc2': 2, 'sinc3': 3, 'sinc4': 4, 'FIR': 3}
+
+# Chop and ac-excitation take two internal conversions for every reported conversion.
+chop_multiplier = {'normal': 1, 'chop': 2, '2-wire ac-excitation': 2, '4-wire ac-excitation': 2}
+
+def conversion_period(data_rate, CHOP = 'normal'):
+    ''' Time (s) between conversions for a given data rate (SPS) and chop mode. '''
+    return chop_multiplier[CHOP] / float(data_rate)
+
+def filter_latency(data_rate, digital_filter, CHOP = 'normal', DELAY = '50us'):
+    ''' Time (s) from start1() or an input change until the first settled conversion. '''
+    return conversion_delays[DELAY] + filter_settling_periods[digital_filter] * conversion_period(data_rate, CHOP)
+
+# The subset of the ADC1261 driver that the datalogger scripts depend on. Any
+# object passed around as "adc" must provide these calls, with these keyword
+# arguments; SimulatedADC1261 and register_cache.CachedADC both do.
+adc_calls = [
+    'setup_measurements()', 'reset()', 'end()', 'check_ID()',
+    "set_frequency(data_rate = 20, digital_filter = 'FIR', print_freq = True)",
+    'PGA(BYPASS = 0, GAIN = 1)', 'check_PGA()',
+    "mode1(CHOP = 'normal', CONVRT = 'continuous', DELAY = '50us')", 'mode2(**gpio)',
+    'mode3(PWDN = 0, STATENB = 0, CRCENB = 0, SPITIM = 0, GPIO3 = 0, GPIO2 = 0, GPIO1 = 0, GPIO0 = 0)', 'check_mode3()',
+    "reference_config(reference_enable = 1, RMUXP = 'Internal Positive', RMUXN = 'Internal Negative')",
+    'choose_inputs(positive, negative)', 'start1()', 'stop()',
+    "collect_measurement(method = 'hardware', reference = 5000, gain = 1, status = 'enabled', bits = False)",
+    'check_temperature()', 'power_readback()', 'maximum_gain(positive_input, negative_input)',
+]
+
+class SimulatedADC1261(object):
+    ''' An in-process ADS1261 for running the acquisition loop off the bench.
+
+        Conversions are produced on a real-time schedule: the first result after
+        start1() (or an input change) arrives after filter_latency(), then one
+        every conversion_period(). collect_measurement() blocks until the next
+        result is due, exactly like waiting on DRDY. If a result is not read in
+        time it is overwritten, as it would be on the device.
+
+        inputs maps pin names to voltages (mV). Unlisted AINx pins sit at
+        2500 + 10*x mV, so e.g. AIN3 - AIN2 reads 10 mV. Codes are scaled
+        by the reference the caller converts them with (collect_measurement's
+        reference), so they read back as the input voltage whatever
+        reference a script assumes. bus and device
+        (SPI bus and chip select) are accepted so several boards can be
+        opened the same way as on the hardware. '''
+
+    def __init__(self, inputs = None, noise = 0.005, avdd = 5000.0, temperature = 25.0, seed = None, bus = 0, device = 0):
+        self.bus, self.device = bus, device
+        self.seed = seed
+        self.inputs = dict(inputs or {})
+        self.noise = noise # mV rms
+        self.avdd = avdd
+        self.temperature = temperature
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.data_rate, self.digital_filter = 20, 'FIR'
+        self.BYPASS, self.gain = 0, 1
+        self.CHOP, self.CONVRT, self.DELAY = 'normal', 'continuous', '50us'
+        self.mode2_settings = {}
+        self.mode3_settings = (0, 0, 0, 0, 0, 0, 0, 0)
+        self.reference = (1, 'Internal Positive', 'Internal Negative')
+        self.positive, self.negative = 'AINCOM', 'AINCOM'
+        self.running = False
+        self.started_at = None
+        self.next_conversion = 0
+        self.conversions_read = 0
+        self.conversions_missed = 0
+
+    # Device management
+    def setup_measurements(self):
+        return 0
+
+    def reset(self):
+        self.__init__(self.inputs, self.noise, self.avdd, self.temperature, self.seed, self.bus, self.device) # same seed, same noise sequence
+        return 0
+
+    def end(self):
+        self.stop()
+        sys.exit()
+
+    def check_ID(self):
+        return 'ADS1261', 'Simulated'
+
+    # Register writes
+    def set_frequency(self, data_rate = 20, digital_filter = 'FIR', print_freq = True):
+        if data_rate not in data_rates or digital_filter not in digital_filters:
+            raise ValueError("Unsupported data rate/filter: " + str(data_rate) + " SPS, " + str(digital_filter))
+        with self.lock:
+            self.data_rate, self.digital_filter = data_rate, digital_filter
+            self._restart()
+        if print_freq: print("Data rate:", data_rate, "SPS, filter:", digital_filter)
+        return 0
+
+    def PGA(self, BYPASS = 0, GAIN = 1):
+        if GAIN not in gains:
+            raise ValueError("Unsupported gain: " + str(GAIN))
+        with self.lock:
+            self.BYPASS, self.gain = BYPASS, GAIN
+            self._restart()
+        return 0
+
+    def check_PGA(self):
+        return self.BYPASS, self.gain
+
+    def print_PGA(self):
+        print("PGA bypass:", self.BYPASS, "Gain:", self.gain)
+
+    def mode1(self, CHOP = 'normal', CONVRT = 'continuous', DELAY = '50us'):
+        if CHOP not in chop_multiplier or DELAY not in conversion_delays:
+            raise ValueError("Unsupported mode1 setting: " + str(CHOP) + ", " + str(DELAY))
+        with self.lock:
+            self.CHOP, self.CONVRT, self.DELAY = CHOP, CONVRT, DELAY
+            self._restart()
+        return 0
+
+    def check_mode1(self):
+        return self.CHOP, self.CONVRT, self.DELAY
+
+    def print_mode1(self):
+        print("Chop:", self.CHOP, "Conversion:", self.CONVRT, "Delay:", self.DELAY)
+
+    def mode2(self, **gpio):
+        self.mode2_settings = gpio
+        return 0
+
+    def mode3(self, PWDN = 0, STATENB = 0, CRCENB = 0, SPITIM = 0, GPIO3 = 0, GPIO2 = 0, GPIO1 = 0, GPIO0 = 0):
+        self.mode3_settings = (PWDN, STATENB, CRCENB, SPITIM, GPIO3, GPIO2, GPIO1, GPIO0)
+        return 0
+
+    def check_mode3(self):
+        return self.mode3_settings
+
+    def reference_config(self, reference_enable = 1, RMUXP = 'Internal Positive', RMUXN = 'Internal Negative'):
+        self.reference = (reference_enable, RMUXP, RMUXN)
+        return 0
+
+    def print_reference_config(self):
+        print("Reference:", self.reference)
+
+    def current_out_magnitude(self, current1 = 'off', current2 = 'off'):
+        return current1, current2
+
+    def current_out_pin(self, IMUX1 = 'NONE', IMUX2 = 'NONE'):
+        return IMUX1, IMUX2
+
+    def burn_out_current_source(self, VBIAS = 'disabled', polarity = 'pull-up mode', magnitude = 'off'):
+        return 0
+
+    def choose_inputs(self, positive, negative):
+        with self.lock:
+            self.positive, self.negative = positive, negative
+            self._restart()
+        return 0
+
+    # Conversion control
+    def start1(self):
+        with self.lock:
+            self.running = True
+            self.started_at = time.perf_counter()
+            self.next_conversion = 0
+        return 0
+
+    def gpio(self, pin, state):
+        if pin == "START":
+            if state == "high": self.start1()
+            else: self.stop()
+        return 0
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+        return 0
+
+    def _restart(self):
+        ''' Register writes restart the digital filter, as on the device. '''
+        if self.running:
+            self.start1()
+
+    def _conversion_time(self, index):
+        latency = filter_latency(self.data_rate, self.digital_filter, self.CHOP, self.DELAY)
+        return self.started_at + latency + index * conversion_period(self.data_rate, self.CHOP)
+
+    def wait_for_drdy(self, timeout = None):
+        ''' Sleep until the next conversion is ready. Returns False on timeout. '''
+        with self.lock:
+            if not self.running:
+                if timeout is not None: time.sleep(timeout)
+                return False
+            ready_at = self._conversion_time(self.next_conversion)
+        delay = ready_at - time.perf_counter()
+        if timeout is not None and delay > timeout:
+            time.sleep(max(timeout, 0))
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+    def _read_conversion(self, reference):
+        with self.lock:
+            now = time.perf_counter()
+            period = conversion_period(self.data_rate, self.CHOP)
+            latest = int((now - self._conversion_time(0)) / period)
+            if latest > self.next_conversion:
+                self.conversions_missed += latest - self.next_conversion
+            self.next_conversion = max(latest, self.next_conversion) + 1
+            self.conversions_read += 1
+            return self._code(self._input_voltage(self.positive) - self._input_voltage(self.negative), reference)
+
+    def _input_voltage(self, pin):
+        if pin in self.inputs:
+            return self.inputs[pin]
+        if pin.startswith('AIN') and pin[3:].isdigit():
+            return 2500.0 + 10.0 * int(pin[3:])
+        return 2500.0
+
+    def _code(self, voltage, reference):
+        ''' 24-bit two's complement code for a differential voltage (mV) against reference (mV). '''
+        voltage = voltage + self.random.gauss(0, self.noise)
+        code = int(round(voltage * self.gain * 2**23 / reference))
+        return max(-2**23, min(2**23 - 1, code))
+
+    def collect_measurement(self, method = 'hardware', reference = 5000, gain = 1, status = 'enabled', bits = False):
+        ''' Block until the next conversion, then return it in mV (or as the raw code with bits = True). '''
+        while not self.wait_for_drdy(timeout = 1):
+            if not self.running:
+                raise RuntimeError("Simulated ADS1261 is stopped; call start1() first.")
+        code = self._read_conversion(float(reference))
+        if bits:
+            return code
+        return code * float(reference) / (gain * 2**23)
+
+    # Housekeeping, each costs one settled conversion on the device
+    def _housekeeping_delay(self):
+        time.sleep(filter_latency(self.data_rate, self.digital_filter, self.CHOP, self.DELAY))
+        self._restart()
+
+    def check_temperature(self):
+        self._housekeeping_delay()
+        return round(self.temperature + self.random.gauss(0, 0.05), 2)
+
+    def power_readback(self):
+        self._housekeeping_delay()
+        return self.avdd + self.random.gauss(0, 0.5)
+
+    def ac_simple(self, mode = 'AC'):
+        return self.power_readback()
+
+    def check_current(self):
+        return 0
+
+    def maximum_gain(self, positive_input, negative_input):
+        ''' Largest PGA gain that keeps the pair within 90% of full scale. '''
+        voltage = abs(self._input_voltage(positive_input) - self._input_voltage(negative_input))
+        maximum_gain = 1
+        for gain in gains:
+            if voltage * gain < 0.9 * self.avdd / 2:
+                maximum_gain = gain
+        return maximum_gain
+
+class SimulatedAS_pH_I2C(object):
+    ''' An in-process Atlas Scientific EZO pH circuit. A reading requested with
+        single_output() or write("R") is ready 900 ms later; until then the
+        probe answers 254 (still processing). '''
+
+    def __init__(self, pH = 7.0, noise = 0.01, seed = None):
+        self.pH = pH
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.ready_at = None
+
+    def write(self, command):
+        if command == "R":
+            self.ready_at = time.time() + 0.9
+        return 0
+
+    def read(self):
+        if self.ready_at is None:
+            return 255
+        if time.time() < self.ready_at:
+            return 254
+        self.ready_at = None
+        return round(self.pH + self.random.gauss(0, self.noise), 3)
+
+    def single_output(self):
+        if self.ready_at is None:
+            self.write("R")
+        return self.read()
+
+class SimulatedDAC7562(object):
+    ''' Stands in for the dac7562evm.DAC7562 driver. The scripts only open the
+        DAC (none of them sets an output yet), so there is nothing to simulate
+        beyond construction. '''
+
+def load_driver(path, module, name, simulation, backend = None):
+    ''' Returns the driver class for the chosen backend: name from module (found under path)
+        on the hardware, simulation otherwise. '''
+    if backend is None:
+        backend = os.environ.get('DATALOGGER_BACKEND', 'hardware')
+    if backend == 'hardware':
+        if path not in sys.path:
+            sys.path.insert(0, path)
+        return getattr(importlib.import_module(module), name)
+    elif backend == 'simulated':
+        return simulation
+    else:
+        raise ValueError("Unknown instrument backend: " + str(backend) + " (expected 'hardware' or 'simulated')")
+
+def load_adc(backend = None):
+    ''' Returns the ADC class to instantiate for the chosen backend. '''
+    return load_driver(path_to_ads1261evm, 'ads1261evm', 'ADC1261', SimulatedADC1261, backend)
+
+def load_dac(backend = None):
+    ''' Returns the DAC class to instantiate for the chosen backend. '''
+    return load_driver(path_to_dac7562evm, 'dac7562evm', 'DAC7562', SimulatedDAC7562, backend)
+
+def load_pH_probe(backend = None):
+    ''' Returns the pH probe class to instantiate for the chosen backend. '''
+    return load_driver(path_to_AS_pH_meter, 'AtlasScientific_pHmeter', 'AS_pH_I2C', SimulatedAS_pH_I2C, backend)
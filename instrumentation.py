@@ -0,0 +1,209 @@
+'''
+#~ Per-stage timing of the acquisition cycle.
+
+multiplex(), GaN_measurement() and WindowBuffer.read() call probes.lap(stage)
+after each step of the cycle (adc.stop(), choose_inputs(), start1(), every
+collect_measurement(), statistics, check_temperature(), ...). A lap records
+the time since the previous lap on the same thread into that stage's
+Histogram, so each step costs one perf_counter() call and one bisect, and
+nothing is allocated. The CSV and binary log writers are wrapped with
+probes.timed().
+
+By default the scripts pass no_probes, whose methods do nothing.
+
+Histograms have fixed, logarithmically spaced buckets from 1 us to 100 s, so
+memory does not grow with the length of the run; percentiles are read off
+the buckets (to within about 12 %), while the count, total, minimum and
+maximum are exact.
+
+Probes().install(path) prints a summary, and saves it as JSON to path, when
+the script exits and whenever it receives SIGUSR1:
+
+kill -USR1 <pid>
+
+The first collect_measurement() lap of every pair includes the wait for the
+digital filter to settle after the mux switch. With orchestration =
+'process' the cycle is timed in the acquisition process, which calls
+forked('acquisition') and so saves its own report, to _timing_acquisition.json,
+when it stops (a forked process exits without running atexit) and on
+SIGUSR1 sent to it; the parent's _timing.json holds the writers.
+
+'''
+
+import os, sys, json, time, atexit, signal, bisect, threading
+
+bucket_bounds = [10**(exponent/20.0) * 1e-6 for exponent in range(0, 161)] # upper bounds (s), 20 per decade from 1 us to 100 s
+
+class Histogram(object):
+    ''' Counts of durations in fixed buckets, with exact count, total, minimum and maximum. '''
+
+    def __init__(self, bounds = bucket_bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # the last bucket catches anything longer than bounds[-1]
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float('inf')
+        self.maximum = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        bucket = bisect.bisect_left(self.bounds, seconds)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds < self.minimum:
+                self.minimum = seconds
+            if seconds > self.maximum:
+                self.maximum = seconds
+
+    def percentile(self, fraction):
+        ''' Upper bound of the bucket holding the given fraction of the durations, capped at the maximum. '''
+        if self.count == 0:
+            return 0.0
+        target, seen = fraction * self.count, 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                return min(self.bounds[bucket] if bucket < len(self.bounds) else self.maximum, self.maximum)
+        return self.maximum
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'minimum': self.minimum if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'maximum': self.maximum,
+        }
+
+class NullProbes(object):
+    ''' Stand-in when instrumentation is off. '''
+
+    def begin(self):
+        return 0
+
+    def lap(self, stage):
+        pass
+
+    def since(self, stage, started):
+        pass
+
+    def timed(self, stage, function):
+        return function
+
+    def forked(self, name):
+        return self
+
+    def dump(self, *args):
+        return 0
+
+no_probes = NullProbes()
+
+class Probes(object):
+    ''' One Histogram per stage. Laps are measured per thread, so boards scanned in parallel do not mix. '''
+
+    def __init__(self, bounds = bucket_bounds):
+        self.bounds = bounds
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.time()
+        self.path = None
+
+    def histogram(self, stage):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, Histogram(self.bounds))
+        return histogram
+
+    def begin(self):
+        ''' Starts lap timing on this thread. Returns the time, for since(). '''
+        now = time.perf_counter()
+        self.local.last = now
+        return now
+
+    def lap(self, stage):
+        ''' Records the time since the previous lap (or begin()) on this thread as stage. '''
+        now = time.perf_counter()
+        last = getattr(self.local, 'last', None)
+        self.local.last = now
+        if last is not None:
+            self.histogram(stage).record(now - last)
+
+    def since(self, stage, started):
+        self.histogram(stage).record(time.perf_counter() - started)
+
+    def timed(self, stage, function):
+        ''' Wraps function so every call is recorded as stage. '''
+        histogram = self.histogram(stage)
+        def timed_function(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.record(time.perf_counter() - started)
+        timed_function.__name__ = getattr(function, '__name__', stage)
+        return timed_function
+
+    def summary(self):
+        with self.lock:
+            stages = dict(self.histograms)
+        return {
+            'started': self.started,
+            'elapsed': time.time() - self.started,
+            'stages': {stage: histogram.summary() for stage, histogram in stages.items()},
+        }
+
+    def report(self, output = sys.stdout):
+        ''' Prints every stage, largest total first, with its share of the multiplex() time. '''
+        summary = self.summary()
+        stages = summary['stages']
+        cycle = stages.get('multiplex', {}).get('total') or sum(stage['total'] for stage in stages.values()) or 1
+        print("Stage timings after", round(summary['elapsed'], 1), "s (ms; share of multiplex time)", file = output)
+        print("Stage".ljust(24), "Count".rjust(9), "Mean".rjust(9), "p50".rjust(9), "p99".rjust(9), "Max".rjust(9), "Total (s)".rjust(10), "Share".rjust(7), file = output)
+        for stage, values in sorted(stages.items(), key = lambda item: -item[1]['total']):
+            print(stage.ljust(24), str(values['count']).rjust(9),
+                *[('%.3f' % (values[key]*1000)).rjust(9) for key in ('mean', 'p50', 'p99', 'maximum')],
+                ('%.2f' % values['total']).rjust(10), ('%.1f%%' % (100*values['total']/cycle)).rjust(7), file = output)
+        return summary
+
+    def dump(self, *args):
+        ''' Prints the report and saves it as JSON if a path was given to install(). Usable as a signal handler. '''
+        summary = self.report()
+        if self.path is not None:
+            try:
+                with open(self.path, 'w') as output:
+                    json.dump(summary, output, indent = 1)
+            except IOError as e:
+                print("Unable to save timings")
+                print(e)
+        return 0
+
+    def forked(self, name):
+        ''' Call first thing in a forked child. Drops the laps inherited from the parent and
+            saves this process's report next to the parent's, with name added. Returns self. '''
+        with self.lock:
+            self.histograms = {}
+        self.local = threading.local()
+        self.started = time.time()
+        if self.path is not None:
+            root, extension = os.path.splitext(self.path)
+            self.path = root + '_' + name + extension
+        return self
+
+    def install(self, path = None, signals = (signal.SIGUSR1,)):
+        ''' Dumps at exit and on each of signals. Call from the main thread. Returns self. '''
+        self.path = path
+        atexit.register(self.dump)
+        for signal_number in signals:
+            try:
+                signal.signal(signal_number, self.dump)
+            except (ValueError, OSError) as e: # not the main thread, or no such signal here
+                print("Unable to install timing signal handler")
+                print(e)
+        return self
@@ -22,23 +22,30 @@ Scroll to the bottom of the program to make changes :)
 '''
 
 
-import sys, statistics, csv, threading, queue, time
-import numpy as np
-import matplotlib.pyplot as plt
+import sys, threading, queue, time, functools
 from datetime import datetime
-path_to_ads1261evm = "/home/pi/Documents/ads1261evm/"
-sys.path.insert(0, path_to_ads1261evm)
-from ads1261evm import ADC1261 as ads1261
+from instrument_backend import load_adc
+ads1261 = load_adc() # set DATALOGGER_BACKEND=simulated to run without the ads1261evm
+from register_cache import CachedADC
+from data_ready import DataReady
+from window_buffer import WindowBuffer
+from settling import settling_conversions, discard_conversions
+from instrumentation import no_probes
+from housekeeping import Housekeeping
+from workers import LoopWorker, WriterWorker, put, shutdown
+from csv_sink import CSVSink
+from status_display import StatusDisplay, window_table
 
-def get_experiment_time():
-    timestamp = datetime.now()
+def get_experiment_time(timestamp = None):
+    if timestamp is None:
+        timestamp = datetime.now()
     measurement_date = str(timestamp.year)+'-'+str(timestamp.month)+'-'+str(timestamp.day)
     measurement_time = str(timestamp.hour)+'.'+str(timestamp.minute)+'.'+str(timestamp.second)+'.'+str(timestamp.microsecond)
     return measurement_date, measurement_time
 
 def initialise_instruments():
     ''' Sets up the device. '''
-    adc = ads1261()
+    adc = CachedADC(ads1261()) # shadow registers drop redundant SPI writes
     adc.setup_measurements()
     adc.reset()
     DeviceID, RevisionID = adc.check_ID()
@@ -98,25 +105,42 @@ def check_maximum_gain(adc, measurement_pairs):
 # keep under 4 kb and append mode -a flag (not -w or -r)
 # repeat
 
-def GaN_measurement(adc, positive, negative, reference, gain, window = 10, status_byte = 'disabled'):
+def GaN_measurement(adc, positive, negative, reference, gain, window = 10, status_byte = 'disabled', data_ready = None, buffer = None, discard = 0, gain_table = None, archive = None, pair = 0, probes = no_probes):
     adc.stop() # stop measurements and allows the register to be changed.
+    probes.lap('stop')
+    if gain_table is not None: # probe before switching, the probe moves the mux
+        gain = gain_table.gain(adc, positive, negative)
+        probes.lap('gain probe')
     adc.choose_inputs(positive = positive, negative = negative)
-    #~ adc.PGA(BYPASS = 0, GAIN = gain)
+    probes.lap('choose_inputs')
+    if gain_table is not None: # per-pair gain, applied with the mux switch
+        adc.PGA(BYPASS = 0, GAIN = gain)
+        probes.lap('PGA')
     adc.start1() # starts measurements and prevents register changes.
-    response = None
-    samples = []
-    for i in range(window):
-        try:
-            response = adc.collect_measurement(method='hardware', reference = reference, gain = gain, status = status_byte, bits = True)
-            response = abs(response) # remove this if necessary
-            #~ print(response)
-            samples.append(response)
-        except KeyboardInterrupt:
-            adc.end()
-    return np.median(samples), np.std(samples)
-
-def multiplex(adc, measurement_pairs, result_queue, gain, reference = 5000, window = 100, status_byte = 'enabled', data_rate = 7200, digital_filter = 'sinc2'):
+    probes.lap('start1')
+    if buffer is None or buffer.window != window:
+        buffer = WindowBuffer(window)
+    try:
+        discard_conversions(adc, discard, data_ready, status = status_byte) # drop anything converted before the inputs settled
+        probes.lap('discard')
+        buffer.read(adc, data_ready, reference = reference, gain = gain, status = status_byte, absolute = True, probes = probes) # remove absolute if necessary
+        if archive is not None:
+            archive.write(pair, buffer.codes[:buffer.count], gain)
+            probes.lap('archive')
+    except KeyboardInterrupt:
+        adc.end()
+    if gain_table is not None:
+        gain_table.check(adc, positive, negative, buffer.peak_code())
+        probes.lap('gain check')
+    median, standard_deviation = buffer.median_and_std()
+    probes.lap('statistics')
+    return median, standard_deviation
+
+def multiplex(adc, measurement_pairs, result_queue, gain, reference = 5000, window = 100, status_byte = 'enabled', data_rate = 7200, digital_filter = 'sinc2', data_ready = None, buffer = None, gain_table = None, archive = None, probes = no_probes, housekeeping = None, analog_settling = 0):
     medians, standard_deviations = [], []
+    started = probes.begin()
+    if housekeeping is not None:
+        housekeeping.refresh() # only the reads that are due
     #~ external_reference = adc.ac_simple('AC') # need to grab the current then replace the ac-excitation settings
     #~ external_reference = adc.power_readback()
     external_reference = reference
@@ -136,22 +160,28 @@ def multiplex(adc, measurement_pairs, result_queue, gain, reference = 5000, wind
     #~ adc.mode3()
     #~ print(adc.check_mode3())
     #~ adc.print_mode3()
-    print("Positive \t Negative \t Median (mV) \t Standard Deviation (uV)")
-    for measurement_pair in measurement_pairs:
+    CHOP, _, DELAY = adc.check_mode1()
+    discard = settling_conversions(data_rate, digital_filter, CHOP = CHOP, DELAY = DELAY, analog_settling = analog_settling)
+    if archive is not None:
+        archive.next_window(external_reference)
+    probes.lap('window set-up')
+    for pair, measurement_pair in enumerate(measurement_pairs):
         positive, negative = measurement_pair[0], measurement_pair[1]
-        median, standard_deviation = GaN_measurement(adc, positive, negative, external_reference, gain, window = window, status_byte = status_byte)
+        median, standard_deviation = GaN_measurement(adc, positive, negative, external_reference, gain, window = window, status_byte = status_byte, data_ready = data_ready, buffer = buffer, discard = discard, gain_table = gain_table, archive = archive, pair = pair, probes = probes)
         medians.append(median)
         standard_deviations.append(standard_deviation)
-        print(positive,'\t\t', negative,'\t\t', round(median,2),'\t\t', round(standard_deviation*1000,2)) # x1000 for uV
         #~ adc.print_mode3()
         #~ print(adc.check_current())
-    temperature = adc.check_temperature()
+    temperature = adc.check_temperature() if housekeeping is None else housekeeping.value('temperature') # cached: see housekeeping.py
+    probes.lap('check_temperature')
     #~ temperature = 0
-    print("Temperature (deg C):", temperature)
-    result_queue.put(("GaN", [external_reference, medians, standard_deviations, temperature]))
-    return 0
+    result = [external_reference, medians, standard_deviations, temperature]
+    probes.since('multiplex', started)
+    if result_queue is not None:
+        result_queue.put(("GaN", result))
+    return result
 
-def write_to_csv(saved_file_location, fieldnames, measurement_date, measurement_time, GaN_sensor_result, measurement_pairs):
+def write_to_csv(csv_sink, measurement_date, measurement_time, GaN_sensor_result, measurement_pairs, start = None):
     ''' This function writes all the results to CSV. It requires the results to be 
         unpacked before submission. Would be good to remove the print requirement. '''
     #~ print(all_results)
@@ -159,31 +189,57 @@ def write_to_csv(saved_file_location, fieldnames, measurement_date, measurement_
     
     row = [measurement_date, measurement_time, external_reference]
     for measurement_pair, median, standard_deviation in zip(measurement_pairs, medians, standard_deviations):
-        row.extend([median, standard_deviation*1000, temperature])
+        row.extend([median, standard_deviation*1000])
+
+    row.extend([temperature])
 
-    row = dict(zip(fieldnames, row))
     try:
-        with open(saved_file_location, 'a') as csvfile:
-            # write each row
-            writer = csv.writer(csvfile)
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writerow(row)
+        csv_sink.write_row(row, start) # batched: see csv_sink.py
     except IOError as e:
-        print("Unable to save to csv")  
+        print("Unable to save to csv")
         print(e)
-    except KeyboardInterrupt:
-        adc.end()
-        csvfile.close()
 
     return 0    
     
-def main():
+def write_to_binary_log(binary_log, start, GaN_sensor_result, measurement_pairs):
+    ''' Appends the same values as write_to_csv() to the binary log (see binary_log.py). '''
+    external_reference, medians, standard_deviations, temperature = GaN_sensor_result
+
+    values = [external_reference]
+    for measurement_pair, median, standard_deviation in zip(measurement_pairs, medians, standard_deviations):
+        values.extend([median, standard_deviation*1000])
+    values.extend([temperature])
+
+    try:
+        binary_log.write(start, values)
+    except IOError as e:
+        print("Unable to save to binary log")
+        print(e)
+
+    return 0
+
+def main(saved_file_location = None):
+    if saved_file_location is None: # started from datalogger.py rather than as a script
+        start_date, start_time = get_experiment_time()
+        saved_file_location = '/media/pi/JEREMY/results/' + str(start_date) + ' ' + str(start_time) + '.csv'
     # Change these parameters:
     window = 18
     data_rate, digital_filter = 20, 'FIR'
     constant_current, pin = '100', 'AIN4'
     gain = 8 # maximise this?
     connected_pH_meter = False # set to true if connected
+    auto_gain = False # True replaces gain with a per-pair gain kept in gain_table_<script>.json, re-ranged after every window (see gain_table.py)
+    streaming_statistics = False # True keeps constant-memory statistics instead of storing each window (very long windows)
+    save_binary = False # True also appends every window to a compact .bin log next to the CSV (see binary_log.py)
+    save_raw = False # True also keeps every raw conversion in memory-mapped segments next to the CSV (see raw_archive.py)
+    rotate_output = False # True splits the CSV into size-capped, gzipped segments with an index file (see rotating_output.py)
+    status_interval = 1 # seconds between console status updates, None for headless runs (see status_display.py)
+    live_plot = False # True plots the results live in a separate process (see live_plot.py)
+    stream_port = None # e.g. 8765 streams every window to local clients as JSON lines (see stream_server.py)
+    acquisition = 'drdy' # 'drdy' waits for the data-ready edge, 'polling' spins on collect_measurement
+    temperature_interval = 60 # seconds between check_temperature() reads, 0 for every cycle (see housekeeping.py)
+    analog_settling = 0 # seconds the sensor needs to settle after each input change, read and discarded (see settling.py); 0 as before
+    instrument = False # True times every stage of the cycle; summary on exit or on kill -USR1 (see instrumentation.py)
        
     # forward measurement pairs
     measurement_pairs = [
@@ -200,6 +256,10 @@ def main():
         'Air Temperature from ADS1261 (deg C)']
         
     # Avoid changing the following parameters:
+    plot = None
+    if live_plot:
+        from live_plot import LivePlot
+        plot = LivePlot(measurement_pairs).start() # fork before the instruments are opened or any threads start
     adc = initialise_instruments()
     reference = adc.power_readback()/2
     #~ reference = 2483
@@ -226,12 +286,28 @@ def main():
         stdev_data.append([])
 
     try:
-        with open(saved_file_location, 'w') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-        print("CSV File successfully created", saved_file_location)
-    except IOError:
+        if rotate_output:
+            from rotating_output import RotatingCSVSink
+            csv_sink = RotatingCSVSink(saved_file_location, fieldnames, max_bytes = 4*1024**2, keep_segments = None, flush_rows = 20, flush_interval = 30, fsync = 'flush')
+        else:
+            csv_sink = CSVSink(saved_file_location, fieldnames, flush_rows = 20, flush_interval = 30, fsync = 'flush') # one open file, rows written in batches
+        print("CSV File successfully created", csv_sink.path)
+    except IOError as e:
         print("Unable to save to csv")
+        print(e)
+        return 1
+    binary_log = None
+    if save_binary:
+        from binary_log import BinaryLog
+        binary_log = BinaryLog(saved_file_location[:-len('.csv')] + '.bin', fieldnames[2:], gain = gain, reference = reference, measurement_pairs = measurement_pairs, time_separator = '.')
+    archive = None
+    if save_raw and not streaming_statistics:
+        from raw_archive import RawArchive
+        archive = RawArchive(saved_file_location[:-len('.csv')] + '_raw', measurement_pairs, data_rate = data_rate) # streaming statistics keep no codes
+    probes = no_probes
+    if instrument:
+        from instrumentation import Probes
+        probes = Probes().install(saved_file_location[:-len('.csv')] + '_timing.json') # stage timings (see instrumentation.py)
 
     _, STATENB_status, _, _, _, _, _, _ = adc.check_mode3()
     if STATENB_status == 0:
@@ -239,57 +315,68 @@ def main():
     else: 
         status_byte = "enabled"
     print("Status byte:", status_byte)
-    flag = 0
-    while(1):        
-        try:
-            start = time.time()
-            q = queue.Queue()
-
-            GaN_sensor_thread = threading.Thread(target = multiplex, args=(adc, measurement_pairs, q, gain, reference, window, status_byte, data_rate, digital_filter))
-            
-            threads = [GaN_sensor_thread]
-            
-            for thread in threads:
-                thread.daemon = True
-                thread.start() # start the threads running
-            
-            # Get timestamp data while the threads are running.
-            timestamp, measurement_date, measurement_time = None, None, None # clear previous values (just in case!)    
-            measurement_date, measurement_time = get_experiment_time() 
-            if flag > 0: csv_thread.join() # what if I put this with the other threads?
-            for thread in threads:
-                thread.join() # wait until all the threads are completed before accessing results
-            
-            # Sometimes the results come in a different order in the queue, so you can't depend on 
-            #   when the results arrive to be indicative of where the results came from. 
-            #   Therefore, get all results into a list.
-            results = []
-            while not q.empty():
-                results.append(q.get())
-            #   Then search the all queued results for the name given in the functions above.
-            #~ print("Results (raw):", results)
-            for element in results:
-                if 'GaN' in element[0]:
-                    GaN_sensor_result = element[1]
-                    if type(GaN_sensor_result) != list:
-                        GaN_sensor_result = list(GaN_sensor_result)
-                else:
-                    pass
-            
-            csv_thread = threading.Thread(target = write_to_csv, args=(saved_file_location, fieldnames, measurement_date, measurement_time, GaN_sensor_result, measurement_pairs))
-            csv_thread.start()
-                        
-            # Could be a good spot to print current results.
-            #~ print("GaN result:", GaN_sensor_result)
-            print("Total time taken (sec):", time.time() - start,'\n')   
-        except KeyboardInterrupt:
-            adc.end()
-        except Exception as e:
-            print("Error in constant current program")
-            print(e)
-            
-    flag = 1 
-    
+    data_ready = DataReady(adc) if acquisition == 'drdy' else None
+    if streaming_statistics: # the buffer is reused by every pair on every cycle
+        from streaming_stats import StreamingWindow
+        buffer = StreamingWindow(window)
+    else:
+        buffer = WindowBuffer(window)
+    gain_table = None
+    if auto_gain:
+        from gain_table import GainTable, gain_table_path
+        gain_table = GainTable(gain_table_path(__file__))
+    housekeeping = Housekeeping().add('temperature', adc.check_temperature, interval = temperature_interval)
+    server = None
+    if stream_port is not None:
+        from stream_server import StreamServer, window_record
+        server = StreamServer(port = stream_port).start()
+    status = StatusDisplay(window_table, interval = status_interval).start() # prints from its own thread, never from acquisition
+    # One long-lived thread per job, connected by bounded queues.
+    stop = threading.Event()
+    results = queue.Queue(maxsize = 8)
+    rows = queue.Queue(maxsize = 64)
+    records = queue.Queue(maxsize = 64)
+    GaN_sensor_worker = LoopWorker('GaN', functools.partial(multiplex, adc, measurement_pairs, None, gain, reference, window, status_byte, data_rate, digital_filter,
+        data_ready = data_ready, buffer = buffer, gain_table = gain_table, archive = archive, probes = probes, housekeeping = housekeeping, analog_settling = analog_settling), results, stop)
+    csv_worker = WriterWorker('csv', probes.timed('write_to_csv', functools.partial(write_to_csv, csv_sink)), rows, stop)
+    workers = [GaN_sensor_worker, csv_worker]
+    if binary_log is not None:
+        workers.append(WriterWorker('binary', probes.timed('write_to_binary_log', functools.partial(write_to_binary_log, binary_log)), records, stop))
+    for worker in workers:
+        worker.start()
+
+    previous_start = None
+    try:
+        while(1):
+            name, start, result = results.get()
+            measurement_date, measurement_time = get_experiment_time(datetime.fromtimestamp(start))
+            put(rows, (measurement_date, measurement_time, result, measurement_pairs, start), stop)
+            if binary_log is not None:
+                put(records, (start, result, measurement_pairs), stop)
+
+            external_reference, medians, standard_deviations, temperature = result
+            status.publish(measurement_pairs, medians, standard_deviations, temperature, [("Total time taken (sec)", start - previous_start if previous_start is not None else None)])
+            if plot is not None:
+                plot.publish(start, medians, temperature)
+            if server is not None:
+                server.publish(window_record(start, measurement_pairs, medians, standard_deviations, temperature, reference = external_reference))
+            previous_start = start
+    except KeyboardInterrupt:
+        print("Stopping: finishing the current cycle and writing the remaining results.")
+    finally:
+        shutdown(workers, stop)
+        csv_sink.close()
+        if binary_log is not None:
+            binary_log.close()
+        if archive is not None:
+            archive.close()
+        if plot is not None:
+            plot.stop()
+        if server is not None:
+            server.stop()
+        status.stop()
+        adc.end()
+
     return 0
 
 if __name__ == "__main__":
@@ -301,4 +388,4 @@ if __name__ == "__main__":
     saved_file_location = '/media/pi/JEREMY/results/' + str(start_date) + ' ' + str(start_time) + '.csv'
     # Do not change past here.
     
-    main()
+    main(saved_file_location)
@@ -0,0 +1,172 @@
+'''
+#~ Live plot of window results in its own process.
+
+LivePlot starts a separate process that draws one trace per measurement
+pair, plus the temperature and pH, against time. The acquisition side calls
+plot.publish(...), which puts one small tuple on a bounded queue without
+waiting; if the plot falls behind, results are dropped for the plot only.
+matplotlib is imported in the plot process, so it costs the logger nothing.
+The process is forked, so start it before the ADC, SPI, GPIO and I2C
+devices are opened: the child then holds none of their handles.
+
+The plot process keeps the last capacity points of every trace in a
+RingBuffer and redraws at up to fps frames per second with blitting: the
+axes are drawn once into a saved background, and each frame only restores
+that background and redraws the lines. The axes are redrawn in full only
+when new data falls outside the current limits, so the frame time does not
+grow with the length of the run.
+
+Usage:
+plot = LivePlot(measurement_pairs).start()
+...
+plot.publish(start, medians, temperature, pH)
+
+'''
+
+import time, queue, multiprocessing
+
+class RingBuffer(object):
+    ''' Fixed-size history of rows of floats. The newest row overwrites the oldest. '''
+
+    def __init__(self, capacity, width):
+        import numpy as np
+        self.capacity = capacity
+        self.data = np.full((capacity, width), np.nan)
+        self.next = 0 # slot for the next row, 0 <= next < capacity
+        self.count = 0
+
+    def append(self, row):
+        self.data[self.next] = row
+        self.next = (self.next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def view(self):
+        ''' The stored rows, oldest first. A slice until the buffer wraps, then one copy. '''
+        import numpy as np
+        if self.count < self.capacity:
+            return self.data[:self.count]
+        return np.concatenate((self.data[self.next:], self.data[:self.next]))
+
+def as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+def run_plot(results, measurement_pairs, capacity = 10000, fps = 30):
+    ''' Entry point of the plot process. Returns when the window is closed or None is received. '''
+    import numpy as np
+    import matplotlib.pyplot as plt
+
+    history = RingBuffer(capacity, len(measurement_pairs) + 3) # time, pairs, temperature, pH
+    plt.ion()
+    figure, (pairs_axes, temperature_axes, pH_axes) = plt.subplots(3, 1, sharex = True, figsize = (10, 8))
+    pairs_axes.set_ylabel("Median (mV)")
+    temperature_axes.set_ylabel("Temperature (deg C)")
+    pH_axes.set_ylabel("pH")
+    pH_axes.set_xlabel("Time (min)")
+    lines = [pairs_axes.plot([], [], label = str(positive) + '-' + str(negative), animated = True)[0] for positive, negative in measurement_pairs]
+    lines.append(temperature_axes.plot([], [], 'k', animated = True)[0])
+    lines.append(pH_axes.plot([], [], 'g', animated = True)[0])
+    axes = [pairs_axes] * len(measurement_pairs) + [temperature_axes, pH_axes]
+    pairs_axes.legend(loc = 'upper left')
+    plt.show(block = False)
+    canvas = figure.canvas
+    canvas.draw()
+    background = canvas.copy_from_bbox(figure.bbox)
+    started = None
+    frame = 1.0/fps
+
+    while plt.fignum_exists(figure.number):
+        frame_start = time.time()
+        new_data = False
+        try:
+            while True:
+                result = results.get_nowait()
+                if result is None:
+                    plt.close(figure)
+                    return 0
+                start, medians, temperature, pH = result
+                if started is None:
+                    started = start
+                history.append([(start - started)/60] + [as_float(median) for median in medians] + [as_float(temperature), as_float(pH)])
+                new_data = True
+        except queue.Empty:
+            pass
+
+        if new_data:
+            data = history.view()
+            for column, line in enumerate(lines):
+                line.set_data(data[:, 0], data[:, column + 1])
+            rescale = False
+            for axis in set(axes):
+                x_low, x_high = axis.get_xlim()
+                y_low, y_high = axis.get_ylim()
+                columns = [column + 1 for column, line_axis in enumerate(axes) if line_axis is axis]
+                values = data[:, columns]
+                if not np.isfinite(values).any():
+                    continue
+                if data[0, 0] < x_low or data[-1, 0] > x_high or np.nanmin(values) < y_low or np.nanmax(values) > y_high:
+                    rescale = True
+            if rescale: # full redraw with some headroom, so this stays rare
+                for axis in set(axes):
+                    axis.relim()
+                    axis.autoscale_view()
+                    y_low, y_high = axis.get_ylim()
+                    margin = 0.1*(y_high - y_low) or 1
+                    axis.set_ylim(y_low - margin, y_high + margin)
+                span = max(data[-1, 0] - data[0, 0], 1)
+                pH_axes.set_xlim(data[0, 0], data[-1, 0] + 0.25*span)
+                canvas.draw()
+                background = canvas.copy_from_bbox(figure.bbox)
+        canvas.restore_region(background)
+        for axis, line in zip(axes, lines):
+            axis.draw_artist(line)
+        canvas.blit(figure.bbox)
+        canvas.flush_events()
+        time.sleep(max(frame - (time.time() - frame_start), 0))
+    return 0
+
+class LivePlot(object):
+    ''' Feeds window results to a plot process without ever blocking the caller. '''
+
+    def __init__(self, measurement_pairs, capacity = 10000, fps = 30, queue_size = 64):
+        self.measurement_pairs = [list(pair) for pair in measurement_pairs]
+        self.capacity = capacity
+        self.fps = fps
+        # fork, so the child does not re-import the calling script (and its instrument drivers)
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        self.results = self.context.Queue(maxsize = queue_size)
+        self.process = None
+        self.dropped = 0
+
+    def start(self):
+        ''' Start before initialise_instruments() and any worker threads, so the forked process
+            copies no open device handles and no running threads. '''
+        self.process = self.context.Process(target = run_plot, args = (self.results, self.measurement_pairs, self.capacity, self.fps), name = 'live plot')
+        self.process.daemon = True
+        self.process.start()
+        return self
+
+    def publish(self, start, medians, temperature, pH = None):
+        if self.process is None or not self.process.is_alive():
+            return False
+        try:
+            self.results.put_nowait((start, list(medians), temperature, pH))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def stop(self, timeout = 2):
+        if self.process is None:
+            return 0
+        try:
+            self.results.put_nowait(None)
+        except queue.Full:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        return 0
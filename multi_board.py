@@ -0,0 +1,131 @@
+'''
+#~ Several ADS1261 boards scanned in parallel.
+
+Every script drives one ADS1261 and walks its measurement pairs one after
+another, so adding chips adds time. A BoardManager runs each board's own
+multiplex() on its own persistent thread and waits for all of them, so a
+scan takes as long as the slowest board rather than the sum. The threads
+spend almost all of their time blocked in the kernel (DRDY edge waits and
+SPI transfers), which releases the GIL, so the boards really do convert at
+the same time.
+
+The merged result has the shape of multiplex() -- the first board's
+reference and temperature, then every board's medians and standard
+deviations in board order, then the samples per pair (None unless windows
+are adaptive) -- plus a sixth element with every extra board's own
+reference and temperature, written as the board_columns() at the end of the
+row. The per-board results are kept in manager.last. The LoopWorker
+timestamp taken before the scan is shared by all boards.
+
+Extra boards are described by dicts:
+{'name': 'Board 2', 'measurement_pairs': [['AIN2', 'AIN3']], 'drdy_pin': 5, 'driver': {...}}
+driver holds keyword arguments for the ADS1261 driver's constructor, e.g.
+the SPI bus and chip select if the installed driver takes them. They are
+checked against the constructor's signature before the board is opened.
+
+'''
+
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from register_cache import CachedADC
+from data_ready import DataReady
+
+class Board(object):
+    ''' One ADS1261 and the multiplex() call that scans its pairs. '''
+
+    def __init__(self, name, adc, measurement_pairs, acquire):
+        self.name = name
+        self.adc = adc
+        self.measurement_pairs = measurement_pairs
+        self.acquire = acquire # acquire() returns a multiplex() result
+
+def board_name(spec, number):
+    return spec.get('name', 'Board ' + str(number))
+
+def merged_layout(measurement_pairs, fieldnames, specs, insert_at):
+    ''' Measurement pairs and CSV fieldnames with every extra board's pairs added.
+        Extra pairs are prefixed with the board name; their columns go before fieldnames[insert_at]. '''
+    pairs, columns = list(measurement_pairs), []
+    for number, spec in enumerate(specs, 2):
+        name = board_name(spec, number)
+        for positive, negative in spec['measurement_pairs']:
+            pairs.append([name + ' ' + positive, negative])
+            columns.extend([name + ' ' + positive + '-' + negative + ' (mV)',
+                'Standard deviation of ' + name + ' ' + positive + '-' + negative + ' (uV)'])
+    return pairs, fieldnames[:insert_at] + columns + fieldnames[insert_at:]
+
+def board_columns(specs):
+    ''' CSV fieldnames for the extra boards' own reference and temperature, in merge() order. '''
+    columns = []
+    for number, spec in enumerate(specs, 2):
+        name = board_name(spec, number)
+        columns.extend([name + ' Reference (mV)', name + ' Air Temperature from ADS1261 (deg C)'])
+    return columns
+
+def driver_options(ads1261, options):
+    ''' Raises ValueError if the driver's constructor does not take every one of options. '''
+    try:
+        parameters = inspect.signature(ads1261).parameters
+    except (TypeError, ValueError): # a builtin with no signature to check
+        return options
+    if any(parameter.kind == parameter.VAR_KEYWORD for parameter in parameters.values()):
+        return options
+    unknown = [option for option in options if option not in parameters]
+    if unknown:
+        raise ValueError("The ADS1261 driver does not take " + ', '.join(unknown) + "; it takes: " + ', '.join(parameters))
+    return options
+
+def open_boards(ads1261, specs, make_acquire, setup = None, use_drdy = True):
+    ''' Opens and sets up every extra board. make_acquire(adc, measurement_pairs, data_ready, name)
+        returns the board's acquire() callable. DRDY is used where the board has a drdy_pin
+        (or the backend signals DRDY itself); otherwise that board polls. '''
+    boards = []
+    for number, spec in enumerate(specs, 2):
+        name = board_name(spec, number)
+        measurement_pairs = spec['measurement_pairs']
+        drdy_pin = spec.get('drdy_pin')
+        options = driver_options(ads1261, spec.get('driver', {}))
+        adc = CachedADC(ads1261(**options))
+        adc.setup_measurements()
+        adc.reset()
+        if setup is not None:
+            setup(adc)
+        data_ready = None
+        if use_drdy and drdy_pin is not None:
+            data_ready = DataReady(adc, drdy_pin)
+        elif use_drdy and hasattr(adc, 'wait_for_drdy'):
+            data_ready = DataReady(adc)
+        boards.append(Board(name, adc, measurement_pairs, make_acquire(adc, measurement_pairs, data_ready, name)))
+        print("Opened", name, options)
+    return boards
+
+def merge(results):
+    ''' Combines per-board multiplex() results into one, including the samples per pair of adaptive windows
+        and the extra boards' reference and temperature. '''
+    external_reference, _, _, temperature = results[0][:4]
+    medians, standard_deviations, samples, boards = [], [], [], []
+    for result in results:
+        medians.extend(result[1])
+        standard_deviations.extend(result[2])
+        if len(result) > 4 and result[4] is not None:
+            samples.extend(result[4])
+    for result in results[1:]:
+        boards.extend([result[0], result[3]])
+    return [external_reference, medians, standard_deviations, temperature, samples if samples and len(samples) == len(medians) else None, boards]
+
+class BoardManager(object):
+    ''' Scans every board at once and merges the results. '''
+
+    def __init__(self, boards):
+        self.boards = list(boards)
+        self.executor = ThreadPoolExecutor(max_workers = len(self.boards), thread_name_prefix = 'board')
+        self.last = None
+
+    def scan(self):
+        futures = [self.executor.submit(board.acquire) for board in self.boards]
+        self.last = [future.result() for future in futures]
+        return merge(self.last)
+
+    def close(self):
+        self.executor.shutdown(wait = True)
+        return 0
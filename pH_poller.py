@@ -0,0 +1,95 @@
+'''
+#~ Background poller for the Atlas Scientific pH probe.
+
+The EZO pH circuit needs about 900 ms to take a reading and answers 254
+("still processing") or 255 ("no data") until it is ready, so polling
+single_output() in a loop just burns CPU and holds up whoever is waiting.
+PHPoller runs on its own thread: it requests a reading, sleeps for the
+probe's conversion time, fetches the result and publishes it, with the time
+it was taken, as a single tuple. Readers call latest() or value() and never
+wait on the probe; replacing the tuple is atomic, so no lock is needed.
+
+Usage:
+pH_poller = PHPoller(pH_probe())
+pH_poller.start()
+...
+commercial_pH_result = pH_poller.value()
+
+In the asyncio mode the thread is not started: async_runner.AsyncRunner
+calls poll_once() from a coroutine instead.
+
+'''
+
+import time, threading
+
+# Atlas Scientific EZO pH data sheet: a single reading ("R") takes 900 ms.
+conversion_time = 0.9
+still_processing = 254
+no_data = 255
+
+def parse_pH(response):
+    ''' Returns the pH as a float, or None while the probe is still busy or has no data. '''
+    try:
+        response = float(response)
+    except (TypeError, ValueError):
+        return None
+    if response in (still_processing, no_data):
+        return None
+    return response
+
+class PHPoller(threading.Thread):
+    ''' Keeps the latest pH reading from an AS_pH_I2C probe. '''
+
+    def __init__(self, pH_meter, interval = 0, stale_after = 10):
+        threading.Thread.__init__(self, name = 'pH poller')
+        self.daemon = True
+        self.pH_meter = pH_meter
+        self.interval = interval # extra wait (s) between readings
+        self.stale_after = stale_after
+        self.stop_event = threading.Event()
+        self.reading = None # (time.time() of the reading, pH)
+
+    def read_once(self):
+        ''' Requests one reading and waits the conversion time for it. Returns the pH or None. '''
+        if hasattr(self.pH_meter, 'write') and hasattr(self.pH_meter, 'read'):
+            self.pH_meter.write("R")
+            if self.stop_event.wait(conversion_time):
+                return None
+            return parse_pH(self.pH_meter.read())
+        pH = parse_pH(self.pH_meter.single_output())
+        while pH is None and not self.stop_event.wait(conversion_time):
+            pH = parse_pH(self.pH_meter.single_output())
+        return pH
+
+    def poll_once(self):
+        ''' Takes one reading and publishes it. Returns the pH or None. '''
+        try:
+            pH = self.read_once()
+        except IOError as e:
+            print("Unable to read the pH probe")
+            print(e)
+            pH = None
+        if pH is not None:
+            self.reading = (time.time(), pH)
+        return pH
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.poll_once()
+            self.stop_event.wait(self.interval)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def latest(self):
+        ''' (timestamp, pH) of the newest reading, or None before the first one. '''
+        return self.reading
+
+    def value(self):
+        ''' The newest pH, or a note for the CSV if there is no recent reading. '''
+        reading = self.reading
+        if reading is None:
+            return "No reading yet."
+        if time.time() - reading[0] > self.stale_after:
+            return "Timed out."
+        return reading[1]
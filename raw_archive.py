@@ -0,0 +1,144 @@
+'''
+#~ Archive of every raw conversion on memory-mapped segment files.
+
+Only the per-window median and standard deviation reach the CSV, so the
+conversions behind them cannot be re-analysed for noise or drift later. A
+RawArchive copies each window's codes straight out of the WindowBuffer into
+a preallocated, memory-mapped segment file, one NumPy block assignment per
+window, so there is no per-sample Python work even at 7200 SPS.
+
+Each segment (raw_00000.bin, raw_00001.bin, ...) holds a 4 kB header
+(magic, record count, JSON with the measurement pairs and data rate) and
+then fixed 12-byte records:
+
+window  uint32  cycle of multiplex()
+pair    uint8   index into measurement_pairs
+gain    uint8   PGA gain used for the pair
+sample  uint16  index of the conversion within the window
+code    int32   raw 24-bit ADS1261 code, sign-extended
+
+windows.bin gives each cycle's start time and reference voltage, so codes
+can be converted to mV with to_mV(). open_segment() and read_archive()
+return read-only memory maps, so nothing is copied until it is used.
+
+'''
+
+import os, json, glob, struct, time
+import numpy as np
+
+magic = b'GANRAW1\n'
+header_size = 4096
+count_offset = len(magic)
+header_prefix = struct.Struct('<QI') # record count, JSON length
+record = np.dtype([('window', '<u4'), ('pair', '<u1'), ('gain', '<u1'), ('sample', '<u2'), ('code', '<i4')])
+window_record = struct.Struct('<Idd') # window, time.time(), reference (mV)
+window_dtype = np.dtype([('window', '<u4'), ('time', '<f8'), ('reference', '<f8')])
+
+class RawArchive(object):
+    ''' Writes raw codes into memory-mapped segments under directory. '''
+
+    def __init__(self, directory, measurement_pairs, data_rate = None, segment_records = 2**22):
+        self.directory = directory
+        self.measurement_pairs = measurement_pairs
+        self.data_rate = data_rate
+        self.segment_records = segment_records
+        self.samples = np.arange(2**16, dtype = np.uint16) # sample column, sliced per window
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.segment = len(glob.glob(os.path.join(directory, 'raw_*.bin'))) # never overwrite an earlier run
+        self.windows = open(os.path.join(directory, 'windows.bin'), 'ab')
+        self.window = os.path.getsize(os.path.join(directory, 'windows.bin')) // window_record.size
+        self.records = None
+        self.samples_written = 0
+        self._header() # too many pairs for the header area fails here, not at the first window
+
+    def _header(self):
+        ''' The JSON header. Raises ValueError if it does not fit in the header area. '''
+        header = json.dumps({'measurement_pairs': self.measurement_pairs, 'data_rate': self.data_rate, 'created': time.time()}).encode('utf-8')
+        if len(magic) + header_prefix.size + len(header) > header_size:
+            raise ValueError("Raw archive header is " + str(len(header)) + " bytes, more than fits in " + str(header_size))
+        return header
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, 'raw_%05d.bin' % self.segment)
+        header = self._header()
+        size = header_size + self.segment_records * record.itemsize
+        with open(path, 'w+b') as segment_file:
+            segment_file.write(magic + header_prefix.pack(0, len(header)) + header)
+            segment_file.truncate(size)
+            if hasattr(os, 'posix_fallocate'): # reserve the blocks now rather than on the first write
+                os.posix_fallocate(segment_file.fileno(), 0, size)
+        self.count = np.memmap(path, dtype = '<u8', mode = 'r+', offset = count_offset, shape = (1,))
+        self.records = np.memmap(path, dtype = record, mode = 'r+', offset = header_size, shape = (self.segment_records,))
+        self.position = 0
+        self.segment += 1
+
+    def next_window(self, reference = None):
+        ''' Starts a new cycle of multiplex(). '''
+        self.window += 1
+        self.windows.write(window_record.pack(self.window, time.time(), float('nan') if reference is None else reference))
+        return self.window
+
+    def write(self, pair, codes, gain):
+        ''' Copies one window of raw codes (an int32 array) into the archive. '''
+        if len(codes) > len(self.samples):
+            raise ValueError("Windows longer than " + str(len(self.samples)) + " conversions cannot be archived")
+        written = 0
+        while written < len(codes):
+            if self.records is None or self.position == self.segment_records:
+                self.close_segment()
+                self._open_segment()
+            n = min(len(codes) - written, self.segment_records - self.position)
+            block = self.records[self.position:self.position + n]
+            block['window'] = self.window
+            block['pair'] = pair
+            block['gain'] = gain
+            block['sample'] = self.samples[written:written + n]
+            block['code'] = codes[written:written + n]
+            self.position += n
+            self.count[0] = self.position # readers only trust records below the count
+            written += n
+        self.samples_written += written
+        return written
+
+    def flush(self):
+        if self.records is not None:
+            self.records.flush()
+            self.count.flush()
+        self.windows.flush()
+        return 0
+
+    def close_segment(self):
+        if self.records is not None:
+            self.flush()
+            self.records, self.count = None, None
+        return 0
+
+    def close(self):
+        self.close_segment()
+        self.windows.close()
+        return 0
+
+def open_segment(path):
+    ''' Returns (header, records) for one segment. records is a read-only memory map of the filled records. '''
+    with open(path, 'rb') as segment_file:
+        if segment_file.read(len(magic)) != magic:
+            raise ValueError("Not a raw archive segment: " + path)
+        count, length = header_prefix.unpack(segment_file.read(header_prefix.size))
+        header = json.loads(segment_file.read(length).decode('utf-8'))
+    if count == 0:
+        return header, np.zeros(0, dtype = record)
+    return header, np.memmap(path, dtype = record, mode = 'r', offset = header_size, shape = (count,))
+
+def read_windows(directory):
+    ''' Start time and reference of every cycle, as a NumPy structured array. '''
+    return np.fromfile(os.path.join(directory, 'windows.bin'), dtype = window_dtype)
+
+def read_archive(directory):
+    ''' Yields (header, records) for every segment in order. '''
+    for path in sorted(glob.glob(os.path.join(directory, 'raw_*.bin'))):
+        yield open_segment(path)
+
+def to_mV(records, reference):
+    ''' Converts records to mV. reference is a single value or one per record. '''
+    return records['code'] * (np.asarray(reference, dtype = np.float64) / (records['gain'] * 2.0**23))
@@ -0,0 +1,162 @@
+'''
+#~ Shadow copy of the ADS1261 register map.
+
+GaN_measurement() and multiplex() re-issue stop(), choose_inputs(), start1(),
+PGA(), set_frequency() and mode3() on every cycle even when nothing has
+changed, and each of those is an SPI round-trip. CachedADC wraps any ADC
+backend and remembers the last value written to each register:
+
+- writes that would not change a register are dropped,
+- stop() is deferred until a register actually has to change, so a
+  stop()/start1() pair around an unchanged configuration costs nothing,
+- check_mode1/2/3() and check_PGA() are answered from the cache until the
+  matching register is written again.
+
+Driver calls that reconfigure the device internally (check_temperature,
+power_readback, ...) invalidate the registers they touch. Any other call the
+cache does not know about invalidates the whole shadow.
+
+Usage:
+adc = CachedADC(ads1261())
+
+'''
+
+import inspect
+
+# Driver call -> register it writes.
+register_writes = {
+    'set_frequency': 'MODE0',
+    'mode1': 'MODE1',
+    'mode2': 'MODE2',
+    'mode3': 'MODE3',
+    'reference_config': 'REF',
+    'current_out_magnitude': 'IMAG',
+    'current_out_pin': 'IMUX',
+    'PGA': 'PGA',
+    'choose_inputs': 'INPMUX',
+    'burn_out_current_source': 'INPBIAS',
+}
+
+# Driver call -> register it reads back.
+register_reads = {
+    'check_mode1': 'MODE1',
+    'check_mode2': 'MODE2',
+    'check_mode3': 'MODE3',
+    'check_PGA': 'PGA',
+}
+
+# Calls that switch the mux (and gain/reference) internally to take their reading.
+housekeeping_calls = {
+    'check_temperature': ('INPMUX', 'PGA', 'REF'),
+    'power_readback': ('INPMUX', 'PGA', 'REF'),
+    'ac_simple': ('INPMUX', 'PGA', 'REF', 'MODE1', 'MODE2'),
+    'maximum_gain': ('INPMUX', 'PGA'),
+    'check_current': ('INPMUX', 'PGA'),
+}
+
+# Calls that neither write registers nor change the conversion state.
+passthrough_calls = set(['collect_measurement', 'wait_for_drdy', 'check_ID', 'setup_measurements',
+    'print_PGA', 'print_mode1', 'print_mode3', 'print_reference_config', 'print_status'])
+
+# Arguments that do not end up in a register.
+ignored_arguments = set(['self', 'print_freq'])
+
+class CachedADC(object):
+    ''' Wraps an ADC backend with a shadow register map. Unknown attributes pass through to the driver. '''
+
+    def __init__(self, adc):
+        self.adc = adc
+        self.registers = {} # register -> (arguments written, value returned by the driver)
+        self.readbacks = {} # register -> last value returned by its check_*() call
+        self.running = None # unknown until we start or stop the ADC
+        self.stop_pending = False
+        self.writes_skipped = 0
+        self.reads_cached = 0
+
+    def _arguments(self, method, args, kwargs):
+        try:
+            bound = inspect.signature(method).bind(*args, **kwargs)
+            bound.apply_defaults()
+            return tuple((name, value) for name, value in bound.arguments.items() if name not in ignored_arguments)
+        except (TypeError, ValueError):
+            return (args, tuple(sorted(kwargs.items())))
+
+    def _flush_stop(self):
+        if self.stop_pending:
+            self.adc.stop()
+            self.stop_pending = False
+            self.running = False
+
+    def _write(self, name, args, kwargs):
+        register = register_writes[name]
+        method = getattr(self.adc, name)
+        arguments = self._arguments(method, args, kwargs)
+        if register in self.registers and self.registers[register][0] == arguments:
+            self.writes_skipped += 1
+            return self.registers[register][1]
+        self._flush_stop()
+        value = method(*args, **kwargs)
+        self.registers[register] = (arguments, value)
+        self.readbacks.pop(register, None)
+        return value
+
+    def _read(self, name, args, kwargs):
+        register = register_reads[name]
+        if register in self.readbacks:
+            self.reads_cached += 1
+            return self.readbacks[register]
+        value = getattr(self.adc, name)(*args, **kwargs)
+        self.readbacks[register] = value
+        return value
+
+    def invalidate(self, registers = None):
+        ''' Forgets the shadow copy of the given registers (all of them by default). '''
+        self._flush_stop()
+        if registers is None:
+            self.registers.clear()
+            self.readbacks.clear()
+            self.running = None
+        else:
+            for register in registers:
+                self.registers.pop(register, None)
+                self.readbacks.pop(register, None)
+        return 0
+
+    def stop(self):
+        if self.running is False or self.stop_pending:
+            self.writes_skipped += 1
+            return 0
+        if self.running is None:
+            self.running = False
+            return self.adc.stop()
+        self.stop_pending = True # only stop if a register really has to change
+        return 0
+
+    def start1(self):
+        if self.stop_pending: # nothing changed since stop(), so keep converting
+            self.stop_pending = False
+            self.writes_skipped += 2
+            return 0
+        self.running = True
+        return self.adc.start1()
+
+    def reset(self):
+        self.invalidate()
+        return self.adc.reset()
+
+    def __getattr__(self, name):
+        if name in register_writes:
+            return lambda *args, **kwargs: self._write(name, args, kwargs)
+        if name in register_reads:
+            return lambda *args, **kwargs: self._read(name, args, kwargs)
+        attribute = getattr(self.adc, name)
+        if not callable(attribute) or name in passthrough_calls:
+            return attribute
+        registers = housekeeping_calls.get(name)
+        def call(*args, **kwargs):
+            if self.stop_pending:
+                self._flush_stop()
+            value = attribute(*args, **kwargs)
+            self.invalidate(registers)
+            return value
+        return call
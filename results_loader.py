@@ -0,0 +1,216 @@
+'''
+#~ Fast loader for results CSVs, cached as .npz sidecars.
+
+load_results('2020-3-5_12-3-4.csv') parses a CSV written by write_to_csv()
+(or a rotated segment, gzipped or not) into a Results object: the column
+names, a datetime64[us] array of the Date/Time columns and a float array of
+every other column. Text such as "Not connected." or an empty cell becomes
+NaN.
+
+Date and Time are written without zero padding ("2020-3-5", "12:3:4.5678",
+or "12.3.4.5678" from the array scripts, where 5678 is the number of
+microseconds), so they are split into whole numbers in one pass over the
+file and turned into datetimes with NumPy arithmetic rather than one
+strptime() per row.
+
+The parsed arrays are saved next to the CSV as <name>.npz with the CSV's
+size and modification time; the next load reads the sidecar instead of the
+CSV unless either has changed (e.g. the run is still being written). An
+incomplete last line is skipped.
+
+Usage:
+python3 results_loader.py results.csv [more.csv ...]
+python3 results_loader.py /home/pi/Documents/Results
+
+'''
+
+import os, sys, csv, glob, gzip, time
+
+cache_version = 1
+
+# fieldnames after Date and Time, as written by each script
+layouts = {
+    'constant_current_no_pH': ('External Reference (mV with 10k resistor)', 'AIN0 to AIN1 (mV)', 'Standard deviation of AIN0 to AIN1 (uV)',
+        'Sense Pad 1 (mV)', 'Standard deviation of Sense Pad 1 (uV)',
+        'Between Sense Pad 1 and 2 (mV)', 'Standard deviation between Sense Pad 1 and 2 (uV)', 'Sense Pad 2 (mV)', 'Standard deviation of Sense Pad 2 (uV)',
+        'Between Sense Pad 2 and 3 (mV)', 'Standard deviation between Sense Pad 2 and 3 (uV)', 'Sense Pad 3 (mV)', 'Standard deviation of Sense Pad 3 (uV)',
+        'Commercial pH Sensor (pH)', 'Air Temperature from ADS1261 (deg C)'),
+    'AC_measurement': ('External Reference (mV with 10k resistor)', 'Sense Pad 1 (mV)', 'Standard deviation of Sense Pad 1 (uV)',
+        'Between Sense Pad 1 and 2 (mV)', 'Standard deviation between Sense Pad 1 and 2 (uV)', 'Sense Pad 2 (mV)', 'Standard deviation of Sense Pad 2 (uV)',
+        'Between Sense Pad 2 and 3 (mV)', 'Standard deviation between Sense Pad 2 and 3 (uV)', 'Sense Pad 3 (mV)', 'Standard deviation of Sense Pad 3 (uV)',
+        'Commercial pH Sensor (pH)', 'Air Temperature from ADS1261 (deg C)'), # also constant_current_no_pH before the AIN0 to AIN1 columns
+    'constant_current': ('Sense Pad 1 (mV)', 'Standard deviation of Sense Pad 1 (mV)', 'Between Sense Pad 1 and 2 (mV)', 'Standard deviation between Sense Pad 1 and 2 (mV)',
+        'Sense Pad 2 (mV)', 'Standard deviation of Sense Pad 2 (mV)', 'Between Sense Pad 2 and 3 (mV)', 'Standard deviation between Sense Pad 2 and 3 (mV)',
+        'Sense Pad 3 (mV)', 'Standard deviation of Sense Pad 3 (mV)', 'Current check (uA)', 'Standard deviation of current (uA)',
+        'Commercial pH Sensor (pH)', 'Air Temperature from ADS1261 (deg C)'), # also AC_external_constant_current
+    'constant_current_2_wire': ('Resistor (985 ohm, mV)', 'Standard deviation of Resistor (uV)', 'Top 2-wire (mV)', 'Standard deviation of Top 2-wire (uV)',
+        'Bottom 2-wire (mV)', 'Standard deviation of Bottom 2-wire (uV)', 'Air Temperature from ADS1261 (deg C)'),
+    'array_constant_100uA': ('Reference Voltage (mV)', 'Sense Pad 1 (mV)', 'Standard deviation of Sense Pad 1 (uV)', 'Sense Pad 2 (mV)',
+        'Standard deviation of Sense Pad 2 (uV)', 'Sense Pad 3 (mV)', 'Standard deviation of Sense Pad 3 (uV)', 'Air Temperature from ADS1261 (deg C)'),
+    'jianan_constant_100uA': ('Reference Voltage (mV)', 'Sense Pad 1 (mV)', 'Standard deviation of Sense Pad 1 (uV)', 'Air Temperature from ADS1261 (deg C)'),
+}
+
+def identify_layout(fieldnames):
+    ''' The script that writes this header, or None (e.g. extra boards were merged in). '''
+    for script, layout in layouts.items():
+        if tuple(fieldnames[2:]) == layout:
+            return script
+    return None
+
+def describe(fieldnames):
+    ''' Groups column indices (into Results.values) by what they hold. Works for any layout. '''
+    groups = {'medians': [], 'standard_deviations': [], 'reference': [], 'pH': [], 'temperature': [], 'other': []}
+    for column, name in enumerate(fieldnames[2:]):
+        if name.startswith('Standard deviation'):
+            groups['standard_deviations'].append(column)
+        elif 'Temperature' in name:
+            groups['temperature'].append(column)
+        elif name.endswith('(pH)'):
+            groups['pH'].append(column)
+        elif 'Reference' in name:
+            groups['reference'].append(column)
+        elif 'mV' in name:
+            groups['medians'].append(column)
+        else:
+            groups['other'].append(column)
+    return groups
+
+class Results(object):
+    ''' One results file: fieldnames, time (datetime64[us], local wall time as written) and values (rows x columns after Date and Time). '''
+
+    def __init__(self, path, fieldnames, time, values):
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.time = time
+        self.values = values
+        self.layout = identify_layout(self.fieldnames)
+
+    def __len__(self):
+        return len(self.time)
+
+    def column(self, name):
+        return self.values[:, self.fieldnames.index(name) - 2]
+
+    def elapsed_minutes(self):
+        import numpy as np
+        if len(self.time) == 0:
+            return np.zeros(0)
+        return (self.time - self.time[0]) / np.timedelta64(60, 's')
+
+def sidecar_path(path):
+    base = path[:-len('.gz')] if path.endswith('.gz') else path
+    return os.path.splitext(base)[0] + '.npz'
+
+def as_datetimes(dates, times):
+    ''' Vectorised conversion of unpadded "Y-M-D" and "H:M:S.microseconds" (":" or ".") strings. '''
+    import numpy as np
+    parts = np.array(','.join(dates).replace('-', ',').split(','), dtype = np.int64).reshape(-1, 3)
+    clock = np.array(','.join(times).replace(':', '.').replace('.', ',').split(','), dtype = np.int64).reshape(-1, 4)
+    days = (parts[:, 0] - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (parts[:, 1] - 1).astype('timedelta64[M]')
+    days = days.astype('datetime64[D]') + (parts[:, 2] - 1).astype('timedelta64[D]')
+    microseconds = ((clock[:, 0]*60 + clock[:, 1])*60 + clock[:, 2])*1000000 + clock[:, 3]
+    return days.astype('datetime64[us]') + microseconds.astype('timedelta64[us]')
+
+def as_float(cell):
+    try:
+        return float(cell)
+    except ValueError:
+        return float('nan')
+
+def split_rows(rows, width, quoted):
+    ''' Rows as lists of exactly width cells. '''
+    rows = list(csv.reader(rows)) if quoted else [row.split(',') for row in rows]
+    padding = [''] * width
+    return [row if len(row) == width else (row + padding)[:width] for row in rows]
+
+def parse_csv(path):
+    ''' Returns (fieldnames, time, values) parsed from the CSV itself. '''
+    import numpy as np
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', newline = '') as csvfile:
+        text = csvfile.read()
+    lines = text.splitlines()
+    if lines and not text.endswith(('\n', '\r')):
+        lines.pop() # still being written
+    if not lines:
+        raise ValueError(path + " has no header")
+    fieldnames = next(csv.reader([lines[0]]))
+    width = len(fieldnames)
+    rows = [line for line in lines[1:] if line]
+    quoted = '"' in text
+    if not rows:
+        return fieldnames, np.zeros(0, dtype = 'datetime64[us]'), np.zeros((0, width - 2))
+    first = split_rows(rows[:1], width, quoted)[0]
+    converters = {column: as_float for column in range(2, width) if np.isnan(as_float(first[column])) or first[column] == ''} # e.g. "Not connected."
+    try:
+        # NumPy's C parser does the numbers; only the text columns go through Python
+        values = np.loadtxt(rows, delimiter = ',', quotechar = '"', usecols = range(2, width), converters = converters, dtype = float, ndmin = 2)
+        stamps = split_rows(rows, 3, quoted) if quoted else [row.split(',', 2) for row in rows]
+        dates, times = [stamp[0] for stamp in stamps], [stamp[1] for stamp in stamps]
+    except ValueError: # ragged rows or text further down: convert every cell in Python
+        columns = list(zip(*split_rows(rows, width, quoted)))
+        values = np.array([[as_float(cell) for cell in columns[column]] for column in range(2, width)], dtype = float).T.reshape(len(rows), width - 2)
+        dates, times = columns[0], columns[1]
+    return fieldnames, as_datetimes(dates, times), values
+
+def load_results(path, cache = True):
+    ''' Loads one results CSV, from its .npz sidecar when the CSV has not changed since it was written. '''
+    import numpy as np
+    status = os.stat(path)
+    sidecar = sidecar_path(path)
+    if cache and os.path.exists(sidecar):
+        try:
+            with np.load(sidecar, allow_pickle = False) as cached:
+                if int(cached['version']) == cache_version and int(cached['size']) == status.st_size and int(cached['mtime']) == status.st_mtime_ns:
+                    return Results(path, cached['fieldnames'].tolist(), cached['time'], cached['values'])
+        except (OSError, ValueError, KeyError) as e:
+            print("Unable to read", sidecar)
+            print(e)
+    fieldnames, times, values = parse_csv(path)
+    if cache:
+        temporary = sidecar + '.tmp'
+        try:
+            with open(temporary, 'wb') as cachefile:
+                np.savez(cachefile, version = cache_version, size = status.st_size, mtime = status.st_mtime_ns,
+                    fieldnames = np.array(fieldnames), time = times, values = values)
+            os.replace(temporary, sidecar)
+        except OSError as e:
+            print("Unable to cache", path)
+            print(e)
+    return Results(path, fieldnames, times, values)
+
+def results_files(directory, pattern = '*.csv*'):
+    ''' Results CSVs (and gzipped segments) in directory, oldest name first. Index files are skipped. '''
+    paths = [path for path in glob.glob(os.path.join(directory, pattern)) if path.endswith(('.csv', '.csv.gz')) and not path.endswith(('_index.csv', '_index.csv.gz'))]
+    return sorted(paths)
+
+def load_runs(paths, cache = True):
+    ''' Loads several CSVs (or every CSV in a directory). Files that cannot be parsed are reported and skipped. '''
+    if isinstance(paths, str):
+        paths = results_files(paths) if os.path.isdir(paths) else [paths]
+    runs = []
+    for path in paths:
+        try:
+            runs.append(load_results(path, cache = cache))
+        except (OSError, ValueError) as e:
+            print("Unable to load", path)
+            print(e)
+    return runs
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python3 results_loader.py results.csv|directory [...]")
+        return 1
+    paths = []
+    for argument in sys.argv[1:]:
+        paths.extend(results_files(argument) if os.path.isdir(argument) else [argument])
+    started = time.perf_counter()
+    runs = load_runs(paths)
+    elapsed = time.perf_counter() - started
+    for run in runs:
+        print(run.path, len(run), "rows", run.layout or "unknown layout")
+    print("Loaded", len(runs), "files in", round(elapsed, 3), "s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+'''
+#~ Size- and time-capped CSV output with background compression.
+
+A single results file grows for as long as the experiment runs. A
+RotatingCSVSink has the same interface as CSVSink but starts a new numbered
+segment (results_00000.csv, results_00001.csv, ...) once the current one
+reaches max_bytes or is max_seconds old. Each closed segment is gzipped by a
+low-priority background thread, and results_index.csv records every
+segment's file, the time.time() start of its first and last window and its
+row count, so a reader can go straight to the segment it needs. With keep_segments set, the
+oldest segments are deleted so storage stays bounded on unattended Pis. A
+segment that is still queued for, or being, compressed is left until the
+compressor has finished with it.
+
+'''
+
+import os, csv, gzip, shutil, time, threading, queue
+from csv_sink import CSVSink
+
+index_fieldnames = ['Segment', 'File', 'Start', 'End', 'Rows']
+
+def lower_priority():
+    ''' Drops the calling thread to the lowest CPU priority (Linux schedules threads individually). '''
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+
+class Compressor(threading.Thread):
+    ''' gzips closed segments one at a time, then calls done(path, compressed_path), or done(path, None) if it failed. '''
+
+    def __init__(self, done):
+        threading.Thread.__init__(self, name = 'compressor')
+        self.daemon = True
+        self.done = done
+        self.segments = queue.Queue()
+
+    def run(self):
+        lower_priority()
+        while True:
+            path = self.segments.get()
+            if path is None:
+                return
+            try:
+                with open(path, 'rb') as segment, gzip.open(path + '.gz', 'wb') as compressed:
+                    shutil.copyfileobj(segment, compressed)
+                os.remove(path)
+                self.done(path, path + '.gz')
+            except (IOError, OSError) as e:
+                print("Unable to compress", path)
+                print(e)
+                self.done(path, None)
+
+    def stop(self):
+        ''' Compresses whatever is queued, then exits. '''
+        self.segments.put(None)
+        self.join()
+
+class RotatingCSVSink(object):
+    ''' A CSVSink that rotates into numbered, compressed segments. '''
+
+    def __init__(self, path, fieldnames, max_bytes = 4*1024**2, max_seconds = None, keep_segments = None, compress = True, **sink_options):
+        self.base = path[:-len('.csv')] if path.endswith('.csv') else path
+        self.fieldnames = fieldnames
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.keep_segments = keep_segments
+        self.sink_options = sink_options
+        self.index_file = self.base + '_index.csv'
+        self.lock = threading.Lock()
+        self.index = self._read_index()
+        self.compressing = set() # files queued for or being compressed, guarded by lock
+        self.compressor = None
+        if compress:
+            self.compressor = Compressor(self._compressed)
+            self.compressor.start()
+        self.sink = None
+        self._open_segment()
+
+    def _read_index(self):
+        try:
+            with open(self.index_file, 'r', newline = '') as index:
+                return list(csv.DictReader(index))
+        except IOError:
+            return []
+
+    def _write_index(self):
+        ''' Replaces the index file atomically. Call with the lock held. '''
+        temporary = self.index_file + '.tmp'
+        with open(temporary, 'w', newline = '') as index:
+            writer = csv.DictWriter(index, fieldnames = index_fieldnames)
+            writer.writeheader()
+            writer.writerows(self.index)
+        os.replace(temporary, self.index_file)
+
+    def _open_segment(self):
+        segment = int(self.index[-1]['Segment']) + 1 if self.index else 0
+        path = self.base + '_%05d.csv' % segment
+        self.sink = CSVSink(path, self.fieldnames, **self.sink_options)
+        self.opened = time.time()
+        with self.lock:
+            self.entry = {'Segment': segment, 'File': os.path.basename(path), 'Start': '', 'End': '', 'Rows': 0}
+            self.index.append(self.entry)
+            self._write_index()
+
+    def _close_segment(self):
+        self.sink.close()
+        with self.lock:
+            self._write_index()
+        if self.compressor is not None and self.entry['Rows']:
+            with self.lock:
+                self.compressing.add(self.entry['File'])
+            self.compressor.segments.put(self.sink.path)
+        self._trim()
+
+    def _compressed(self, path, compressed_path):
+        with self.lock:
+            self.compressing.discard(os.path.basename(path))
+            if compressed_path is not None:
+                for entry in self.index:
+                    if entry['File'] == os.path.basename(path):
+                        entry['File'] = os.path.basename(compressed_path)
+                self._write_index()
+        self._trim() # segments held back while they were compressed
+
+    def _trim(self):
+        ''' Deletes the oldest segments beyond keep_segments, stopping at one the compressor still has. '''
+        if self.keep_segments is None:
+            return
+        with self.lock:
+            while len(self.index) > max(self.keep_segments, 1):
+                if self.index[0]['File'] in self.compressing:
+                    break
+                entry = self.index.pop(0)
+                for name in (entry['File'], entry['File'] + '.gz'):
+                    try:
+                        os.remove(os.path.join(os.path.dirname(self.base), name))
+                    except OSError:
+                        pass
+            self._write_index()
+
+    @property
+    def path(self):
+        return self.sink.path
+
+    def write_row(self, row, start = None):
+        ''' Writes one row. start is the time.time() the row's window began, used for the index (default: now). '''
+        now = time.time()
+        if start is None:
+            start = now
+        self.sink.write_row(row)
+        with self.lock:
+            if not self.entry['Rows']:
+                self.entry['Start'] = start
+            self.entry['End'] = start
+            self.entry['Rows'] = int(self.entry['Rows']) + 1
+        # size is checked after each batch reaches the file, so a segment can overrun by one batch
+        if (not self.sink.pending and self.sink.csvfile.tell() >= self.max_bytes) or \
+                (self.max_seconds is not None and now - self.opened >= self.max_seconds):
+            self._close_segment()
+            self._open_segment()
+        return 0
+
+    def flush(self):
+        self.sink.flush()
+        with self.lock:
+            self._write_index()
+        return 0
+
+    def close(self):
+        ''' Closes the current segment and waits for the compressor to finish. '''
+        if self.sink.csvfile.closed:
+            return 0
+        self._close_segment()
+        if self.compressor is not None:
+            self.compressor.stop()
+        return 0
@@ -0,0 +1,53 @@
+'''
+#~ Settling-time-aware input switching for the ADS1261.
+
+After choose_inputs() the measurement is not valid until the digital filter
+has settled. How long that takes depends on the data rate (set_frequency),
+the digital filter (sinc1-sinc4, FIR) and the mode1 CHOP and DELAY settings,
+so a fixed time.sleep() is either too long (dead time) or too short
+(unsettled data).
+
+Every register write (including INPMUX via choose_inputs) and start1()
+restarts the ADS1261 digital filter, and DRDY is held off until the filter
+has settled; that latency is absorbed by waiting for the first conversion.
+Only conversions produced while the filter is still running from the
+previous inputs (restarted = False), or while an external front end is
+still settling (analog_settling), have to be thrown away.
+
+The scripts set analog_settling in main(): the time the sensor and its
+wiring need after the mux moves to a new pair, e.g. about 17 RC time
+constants of the source resistance and input capacitance for 24-bit
+settling. constant_current_2_wire.py keeps the 100 ms it always allowed;
+the conversions in that time are read and discarded rather than slept
+through, so the first kept conversion is fresh.
+
+'''
+
+import math
+from instrument_backend import conversion_period, conversion_delays, filter_latency
+from data_ready import collect_conversion
+
+def settling_conversions(data_rate, digital_filter, CHOP = 'normal', DELAY = '50us', restarted = True, analog_settling = 0):
+    ''' Number of conversions to discard after switching inputs.
+        analog_settling is any extra settling time (s) needed by the sensor circuit. '''
+    period = conversion_period(data_rate, CHOP)
+    if restarted: # conversion n after start1() filters the input from DELAY + n periods onwards
+        discard = int(math.ceil((analog_settling - conversion_delays[DELAY]) / period - 1e-9))
+    else:
+        discard = int(math.ceil(analog_settling / period - 1e-9))
+        discard += int(math.ceil(filter_latency(data_rate, digital_filter, CHOP, DELAY) / period - 1e-9)) - 1
+    return max(discard, 0)
+
+def settling_time(data_rate, digital_filter, CHOP = 'normal', DELAY = '50us', restarted = True, analog_settling = 0):
+    ''' Dead time (s) between switching inputs and the first conversion that is kept. '''
+    discard = settling_conversions(data_rate, digital_filter, CHOP, DELAY, restarted, analog_settling)
+    period = conversion_period(data_rate, CHOP)
+    if restarted:
+        return filter_latency(data_rate, digital_filter, CHOP, DELAY) + discard * period
+    return (discard + 1) * period
+
+def discard_conversions(adc, count, data_ready = None, status = 'enabled', timeout = 1.0):
+    ''' Reads and throws away count conversions. '''
+    for i in range(count):
+        collect_conversion(adc, data_ready, status = status, bits = True, timeout = timeout)
+    return 0
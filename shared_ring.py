@@ -0,0 +1,252 @@
+'''
+#~ Acquisition in its own process, with results passed through shared memory.
+
+With the ADC loop, statistics, CSV writing and printing all in one process,
+they share the GIL, and a busy sink shows up as jitter in the cycle time.
+AcquisitionProcess forks a process that runs acquire() (e.g. multiplex())
+back to back and writes every result into a SharedRing, a fixed set of
+slots in multiprocessing.shared_memory. The parent's writers and analysis
+read the ring without ever blocking the acquisition process: the writer
+never waits, and a reader that falls more than a ring behind skips the
+records it missed (counted in reader.skipped).
+
+Each slot holds a sequence number, a length and the payload. The writer
+clears the slot's sequence number, writes the payload and then sets the
+sequence number, so a reader that copies a slot and finds the same sequence
+number before and after knows the copy is whole.
+
+Raw samples can go the same way: a RingArchive has the next_window()/write()
+interface of raw_archive.RawArchive, so it can be passed to multiplex() as
+its archive, and an ArchiveWorker in the parent copies the codes into the
+real archive.
+
+Fork before starting any threads in the parent, and do not use the ADC in
+the parent once the acquisition process has started.
+
+'''
+
+import math, time, struct, signal, threading, multiprocessing
+from multiprocessing import shared_memory
+from workers import put
+from instrumentation import no_probes
+
+head = struct.Struct('<Q') # sequence number of the next record to be written
+slot_header = struct.Struct('<QI') # 1 + sequence number of the record in the slot (0 while writing), payload length
+
+class SharedRing(object):
+    ''' Single-writer, many-reader ring of byte records in shared memory. '''
+
+    def __init__(self, slots = 64, slot_size = 4096, name = None):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.stride = slot_header.size + slot_size
+        size = head.size + slots * self.stride
+        self.owner = name is None # the creator removes the block on close()
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create = True, size = size)
+            self.memory.buf[:size] = bytes(size)
+        else:
+            self.memory = shared_memory.SharedMemory(name = name)
+        self.name = self.memory.name
+
+    def head(self):
+        return head.unpack_from(self.memory.buf, 0)[0]
+
+    def write(self, payload):
+        if len(payload) > self.slot_size:
+            raise ValueError("Record of " + str(len(payload)) + " bytes does not fit a " + str(self.slot_size) + " byte slot")
+        buffer = self.memory.buf
+        sequence = self.head()
+        offset = head.size + (sequence % self.slots) * self.stride
+        slot_header.pack_into(buffer, offset, 0, 0)
+        buffer[offset + slot_header.size:offset + slot_header.size + len(payload)] = payload
+        slot_header.pack_into(buffer, offset, sequence + 1, len(payload))
+        head.pack_into(buffer, 0, sequence + 1)
+        return sequence
+
+    def reader(self, latest = False):
+        return RingReader(self, self.head() if latest else 0)
+
+    def close(self):
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+        return 0
+
+class RingReader(object):
+    ''' One consumer's position in a SharedRing. '''
+
+    def __init__(self, ring, sequence = 0):
+        self.ring = ring
+        self.sequence = sequence
+        self.skipped = 0
+
+    def read(self):
+        ''' The next record, or None if there is nothing new yet. '''
+        ring, buffer = self.ring, self.ring.memory.buf
+        while True:
+            newest = ring.head()
+            if self.sequence >= newest:
+                return None
+            if newest - self.sequence > ring.slots: # lapped by the writer
+                self.skipped += newest - ring.slots - self.sequence
+                self.sequence = newest - ring.slots
+            offset = head.size + (self.sequence % ring.slots) * ring.stride
+            marker, length = slot_header.unpack_from(buffer, offset)
+            payload = bytes(buffer[offset + slot_header.size:offset + slot_header.size + length])
+            if marker == self.sequence + 1 and slot_header.unpack_from(buffer, offset)[0] == marker:
+                self.sequence += 1
+                return payload
+            # overwritten while we copied it: catch up and try again
+
+    def get(self, timeout = None, poll = 0.005):
+        ''' Waits up to timeout (s) for the next record. '''
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            payload = self.read()
+            if payload is not None or (deadline is not None and time.time() >= deadline):
+                return payload
+            time.sleep(poll)
+
+result_header = struct.Struct('<dddIII') # start, reference, temperature, pairs, 1 if samples per pair follow, extra values (other boards' reference and temperature)
+
+def result_size(pairs, extras = 0):
+    ''' Bytes needed by encode_result() for this many measurement pairs and extra values. '''
+    return result_header.size + 24 * pairs + 8 * extras
+
+def as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+def encode_result(start, result):
+    ''' Packs (start, multiplex() result) as doubles, with the samples per pair of adaptive windows and
+        the extra values of multi_board.merge() if present. '''
+    external_reference, medians, standard_deviations, temperature = result[:4]
+    samples = result[4] if len(result) > 4 and result[4] is not None else []
+    extras = result[5] if len(result) > 5 else []
+    values = [as_float(value) for value in list(medians) + list(standard_deviations) + list(samples) + list(extras)]
+    header = result_header.pack(start, as_float(external_reference), as_float(temperature), len(medians), int(len(samples) > 0), len(extras))
+    return header + struct.pack('<' + 'd' * len(values), *values)
+
+def decode_result(payload):
+    start, external_reference, temperature, pairs, has_samples, extras = result_header.unpack_from(payload)
+    values = struct.unpack_from('<' + 'd' * ((2 + has_samples) * pairs + extras), payload, result_header.size)
+    result = [external_reference, list(values[:pairs]), list(values[pairs:2*pairs]), temperature]
+    samples = [int(count) for count in values[2*pairs:3*pairs]] if has_samples else None
+    if samples is not None or extras:
+        result.append(samples)
+    if extras:
+        result.append(list(values[(2 + has_samples) * pairs:]))
+    return start, result
+
+def acquisition_loop(acquire, ring, stop, probes = no_probes):
+    ''' Runs in the acquisition process. Ctrl-C is left to the parent, which sets stop. '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    probes.forked('acquisition')
+    try:
+        while not stop.is_set():
+            start = time.time()
+            try:
+                result = acquire()
+            except Exception as e:
+                print("Error in acquisition process")
+                print(e)
+                stop.wait(0.1)
+                continue
+            ring.write(encode_result(start, result))
+    finally:
+        probes.dump() # the process ends in os._exit(), which skips atexit
+
+class AcquisitionProcess(object):
+    ''' Runs acquire() in a forked process and publishes each result into ring. '''
+
+    def __init__(self, acquire, ring, probes = no_probes):
+        self.acquire = acquire
+        self.ring = ring
+        self.probes = probes # the stage timings recorded by acquire() are saved by the child (see instrumentation.py)
+        self.context = multiprocessing.get_context('fork') # the child keeps the parent's open ADC
+        self.stop_event = self.context.Event()
+        self.process = None
+
+    def start(self):
+        self.process = self.context.Process(target = acquisition_loop, args = (self.acquire, self.ring, self.stop_event, self.probes), name = 'acquisition')
+        self.process.daemon = True
+        self.process.start()
+        return self
+
+    def stop(self, timeout = 30):
+        ''' Lets the current cycle finish, then waits for the process to exit. '''
+        self.stop_event.set()
+        if self.process is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        return 0
+
+class RingWorker(threading.Thread):
+    ''' Parent-side stand-in for the acquisition LoopWorker: puts (name, start, result) from the ring on output.
+        Stop the AcquisitionProcess first; this then drains what is left in the ring. '''
+
+    def __init__(self, name, reader, output, stop):
+        threading.Thread.__init__(self, name = name)
+        self.daemon = True
+        self.reader = reader
+        self.output = output
+        self.stop = stop
+
+    def run(self):
+        while True:
+            payload = self.reader.get(timeout = 0.1)
+            if payload is None:
+                if self.stop.is_set():
+                    return
+                continue
+            start, result = decode_result(payload)
+            if not put(self.output, (self.name, start, result), self.stop):
+                return
+
+window_marker = struct.Struct('<Bd') # 0, reference
+codes_header = struct.Struct('<BBBI') # 1, pair, gain, number of codes
+
+def raw_slot_size(window):
+    return codes_header.size + 4 * window
+
+class RingArchive(object):
+    ''' Looks like a RawArchive to multiplex(), but sends the codes through a SharedRing. '''
+
+    def __init__(self, ring):
+        self.ring = ring
+
+    def next_window(self, reference = None):
+        self.ring.write(window_marker.pack(0, math.nan if reference is None else reference))
+
+    def write(self, pair, codes, gain):
+        self.ring.write(codes_header.pack(1, pair, gain, len(codes)) + codes.astype('<i4').tobytes())
+        return len(codes)
+
+class ArchiveWorker(threading.Thread):
+    ''' Copies codes from a RingArchive's ring into a raw_archive.RawArchive. '''
+
+    def __init__(self, reader, archive, stop):
+        threading.Thread.__init__(self, name = 'raw archive')
+        self.daemon = True
+        self.reader = reader
+        self.archive = archive
+        self.stop = stop
+
+    def run(self):
+        import numpy as np
+        while True:
+            payload = self.reader.get(timeout = 0.1)
+            if payload is None:
+                if self.stop.is_set():
+                    return
+                continue
+            if payload[0] == 0:
+                _, reference = window_marker.unpack(payload)
+                self.archive.next_window(None if math.isnan(reference) else reference)
+            else:
+                _, pair, gain, count = codes_header.unpack_from(payload)
+                self.archive.write(pair, np.frombuffer(payload, dtype = '<i4', count = count, offset = codes_header.size), gain)
@@ -0,0 +1,86 @@
+'''
+#~ Rate-limited console status view.
+
+Printing a table row per pair on every cycle puts terminal I/O on the
+acquisition path, and a slow SSH session then stretches the measurement
+cycle. Instead, the acquisition side calls status.publish(...) with the
+latest results, which only replaces a tuple. A background thread wakes every
+interval seconds and, if something new was published, renders it with
+render(*state) and writes it in one go. Anything published in between is
+skipped, so the console never holds up acquisition.
+
+With interval = None (headless runs) no thread is started and publish()
+just stores the state.
+
+Usage:
+status = StatusDisplay(window_table, interval = 1)
+status.start()
+...
+status.publish(measurement_pairs, medians, standard_deviations, temperature, [("Total time taken (sec)", cycle_time)])
+
+'''
+
+import sys, threading
+
+class StatusDisplay(object):
+    ''' Renders the latest published state at most once per interval on its own thread. '''
+
+    def __init__(self, render, interval = 1.0, output = None):
+        self.render = render
+        self.interval = interval
+        self.output = output if output is not None else sys.stdout
+        self.state = (0, None) # (publish count, arguments for render)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.interval is None:
+            return self
+        self.thread = threading.Thread(target = self._run, name = 'status')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def publish(self, *state):
+        self.state = (self.state[0] + 1, state)
+
+    def _show(self, shown):
+        published, state = self.state
+        if published == shown:
+            return shown
+        try:
+            self.output.write(self.render(*state))
+            self.output.flush()
+        except Exception as e:
+            print("Unable to show status")
+            print(e)
+        return published
+
+    def _run(self):
+        shown = 0
+        while not self.stop_event.wait(self.interval):
+            shown = self._show(shown)
+        self._show(shown)
+
+    def stop(self):
+        ''' Shows the last published state, if it has not been shown yet, and stops the thread. '''
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(self.interval + 1)
+        return 0
+
+def notes_text(notes):
+    return ''.join(str(label) + ": " + str(value) + "\n" for label, value in notes if value is not None)
+
+def window_table(measurement_pairs, medians, standard_deviations, temperature, notes = ()):
+    ''' The multiplex() table: one row per pair, then the temperature and any (label, value) notes. '''
+    text = "Positive \t Negative \t Median (mV) \t Standard Deviation (uV)\n"
+    for measurement_pair, median, standard_deviation in zip(measurement_pairs, medians, standard_deviations):
+        text += str(measurement_pair[0]) + "\t\t " + str(measurement_pair[1]) + "\t\t " + str(round(median, 4)) + "\t\t " + str(round(standard_deviation*1000, 2)) + "\n" # x1000 for uV
+    text += "Temperature (deg C): " + str(temperature) + "\n"
+    return text + notes_text(notes) + "\n"
+
+def field_table(fieldnames, row, notes = ()):
+    ''' One "fieldname value" line per CSV column of row (a dict), then any (label, value) notes. '''
+    text = ''.join(str(fieldname) + " " + str(row.get(fieldname, '')) + "\n" for fieldname in fieldnames)
+    return text + notes_text(notes) + "\n"
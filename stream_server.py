@@ -0,0 +1,176 @@
+'''
+#~ Local streaming server for live window results.
+
+StreamServer listens on a TCP port and sends every published window to every
+connected client as one line of JSON (newline-delimited JSON). A client that
+opens with an HTTP GET gets the same stream after an HTTP response header, so
+curl or a browser also work:
+
+nc 127.0.0.1 8765
+curl -N http://127.0.0.1:8765/
+
+Each client has its own sender thread and a bounded buffer of client_buffer
+lines. publish() only encodes the record once and puts the line on each
+buffer without waiting; a client whose buffer is full is disconnected, so a
+slow client can never hold up the ADC.
+
+Test client:
+python3 stream_server.py [host] [port]
+
+'''
+
+import sys, json, math, socket, threading, queue
+
+http_header = b"HTTP/1.0 200 OK\r\nContent-Type: application/x-ndjson\r\nCache-Control: no-cache\r\n\r\n"
+
+def json_value(value):
+    ''' Plain floats for numpy scalars, None for NaN, strings left alone. '''
+    if isinstance(value, (list, tuple)):
+        return [json_value(item) for item in value]
+    if isinstance(value, str) or value is None:
+        return value
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    return None if math.isnan(value) or math.isinf(value) else value
+
+def window_record(start, measurement_pairs, medians, standard_deviations, temperature, **extra):
+    ''' One window of multiplex() results as a JSON-ready dict. Standard deviations are in uV. '''
+    record = {
+        'time': start,
+        'pairs': [str(positive) + '-' + str(negative) for positive, negative in measurement_pairs],
+        'medians_mV': json_value(medians),
+        'standard_deviations_uV': json_value([standard_deviation*1000 for standard_deviation in standard_deviations]),
+        'temperature': json_value(temperature),
+    }
+    for key, value in extra.items():
+        record[key] = json_value(value)
+    return record
+
+class Client(threading.Thread):
+    ''' Sends queued lines to one connected socket. '''
+
+    def __init__(self, connection, address, client_buffer):
+        threading.Thread.__init__(self, name = 'stream client ' + str(address))
+        self.daemon = True
+        self.connection = connection
+        self.address = address
+        self.lines = queue.Queue(maxsize = client_buffer)
+        self.closed = False
+
+    def handshake(self):
+        ''' Answers HTTP clients with a response header; raw TCP clients send nothing. '''
+        self.connection.settimeout(0.5)
+        try:
+            request = self.connection.recv(1024)
+        except socket.timeout:
+            request = b''
+        self.connection.settimeout(None)
+        if request.startswith(b'GET'):
+            self.connection.sendall(http_header)
+
+    def run(self):
+        try:
+            self.handshake()
+            while not self.closed:
+                line = self.lines.get()
+                if line is None:
+                    break
+                self.connection.sendall(line)
+        except (OSError, socket.error):
+            pass
+        self.close()
+
+    def close(self):
+        self.closed = True
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.connection.close()
+
+class StreamServer(object):
+    ''' Pushes each published record to every subscriber as newline-delimited JSON. '''
+
+    def __init__(self, host = '127.0.0.1', port = 8765, client_buffer = 32):
+        self.host = host
+        self.port = port
+        self.client_buffer = client_buffer
+        self.clients = []
+        self.lock = threading.Lock()
+        self.dropped_clients = 0
+        self.listener = None
+
+    def start(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.port = self.listener.getsockname()[1] # port = 0 picks a free port
+        self.listener.listen(8)
+        thread = threading.Thread(target = self._accept, name = 'stream server')
+        thread.daemon = True
+        thread.start()
+        print("Streaming results on", self.host + ':' + str(self.port))
+        return self
+
+    def _accept(self):
+        while True:
+            try:
+                connection, address = self.listener.accept()
+            except OSError: # listener closed by stop()
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = Client(connection, address, self.client_buffer)
+            with self.lock:
+                self.clients.append(client)
+            client.start()
+
+    def publish(self, record):
+        ''' Queues record for every client without blocking. Clients that have fallen behind are dropped. '''
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        with self.lock:
+            clients = self.clients
+            self.clients = []
+            for client in clients:
+                if client.closed:
+                    continue
+                try:
+                    client.lines.put_nowait(line)
+                    self.clients.append(client)
+                except queue.Full:
+                    self.dropped_clients += 1
+                    client.close() # also wakes a sendall() stuck on the slow client
+        return len(self.clients)
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.close()
+        with self.lock:
+            for client in self.clients:
+                try:
+                    client.lines.put_nowait(None)
+                except queue.Full:
+                    client.close()
+            self.clients = []
+        return 0
+
+def main():
+    ''' Test client: prints every record from a running StreamServer. '''
+    host = sys.argv[1] if len(sys.argv) > 1 else '127.0.0.1'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+    try:
+        with socket.create_connection((host, port)) as connection:
+            for line in connection.makefile('r', encoding = 'utf-8'):
+                record = json.loads(line)
+                print(record.get('time'), dict(zip(record.get('pairs', []), record.get('medians_mV', []))), record.get('temperature'))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print("Unable to connect to", host + ':' + str(port))
+        print(e)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
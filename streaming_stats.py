@@ -0,0 +1,167 @@
+'''
+#~ Streaming statistics for measurement windows.
+
+Statistics are updated once per conversion, so they are ready the moment a
+window closes and use the same small amount of memory whether the window is
+10 samples or 100 000:
+
+RunningStatistics   Welford's online mean and variance
+P2Quantile          the P-squared quantile estimator (Jain & Chlamtac, 1985),
+                    a streaming median with five markers
+StreamingWindow     drop-in alternative to window_buffer.WindowBuffer for
+                    GaN_measurement() that never stores the window
+
+'''
+
+import math
+from data_ready import collect_conversion
+from instrumentation import no_probes
+
+class RunningStatistics(object):
+    ''' Welford's online mean/variance. '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total_mean = 0.0
+        self.sum_of_squares = 0.0 # sum of squared differences from the mean
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.total_mean
+        self.total_mean += delta / self.count
+        self.sum_of_squares += delta * (value - self.total_mean)
+
+    def mean(self):
+        if self.count < 1:
+            raise ValueError("mean requires at least one data point")
+        return self.total_mean
+
+    def pvariance(self):
+        if self.count < 1:
+            raise ValueError("pvariance requires at least one data point")
+        return self.sum_of_squares / self.count
+
+    def variance(self):
+        if self.count < 2:
+            raise ValueError("variance requires at least two data points")
+        return self.sum_of_squares / (self.count - 1)
+
+    def pstdev(self):
+        ''' Population standard deviation, as np.std(). '''
+        return math.sqrt(self.pvariance())
+
+    def stdev(self):
+        ''' Sample standard deviation, as statistics.stdev(). '''
+        return math.sqrt(self.variance())
+
+class P2Quantile(object):
+    ''' Streaming estimate of a single quantile (0.5 for the median) in constant memory. '''
+
+    def __init__(self, quantile = 0.5):
+        self.quantile = quantile
+        self.reset()
+
+    def reset(self):
+        p = self.quantile
+        self.count = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2*p, 1 + 4*p, 3 + 2*p, 5]
+        self.increments = [0, p/2, p, (1 + p)/2, 1]
+
+    def update(self, value):
+        self.count += 1
+        heights, positions = self.heights, self.positions
+        if self.count <= 5:
+            heights.append(value)
+            heights.sort()
+            return
+        if value < heights[0]:
+            heights[0] = value
+            k = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            k = 3
+        else:
+            k = 0
+            while value >= heights[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in range(1, 4):
+            d = self.desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + d * (heights[i + d] - heights[i]) / (positions[i + d] - positions[i])
+                heights[i] = height
+                positions[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self):
+        if self.count == 0:
+            raise ValueError("quantile requires at least one data point")
+        if self.count <= 5: # exact while we still hold every sample
+            index = self.quantile * (self.count - 1)
+            lower = int(math.floor(index))
+            upper = min(lower + 1, self.count - 1)
+            return self.heights[lower] + (index - lower) * (self.heights[upper] - self.heights[lower])
+        return self.heights[2]
+
+class StreamingWindow(object):
+    ''' Same interface as window_buffer.WindowBuffer, but the window's median and
+        standard deviation are accumulated per conversion instead of stored. '''
+
+    def __init__(self, window):
+        self.window = window
+        self.statistics = RunningStatistics()
+        self.median = P2Quantile(0.5)
+        self.count = 0
+        self.peak = 0
+
+    def read(self, adc, data_ready = None, reference = 5000, gain = 1, status = 'enabled', absolute = False, probes = no_probes, until = None, skip = (TimeoutError,)):
+        ''' Reads one window of raw codes, updating the statistics in mV as each conversion arrives.
+            A conversion that raises one of skip is printed and skipped. until(code), if given,
+            can end the window early (see convergence.py). '''
+        self.statistics.reset()
+        self.median.reset()
+        self.count, self.peak = 0, 0
+        scale = float(reference) / (gain * 2**23)
+        for i in range(self.window):
+            try:
+                code = collect_conversion(adc, data_ready, reference = reference, gain = gain, status = status, bits = True)
+                probes.lap('collect_measurement')
+            except skip as e:
+                print("Skipped a conversion:", e)
+                continue
+            self.peak = max(self.peak, abs(code))
+            value = code * scale
+            if absolute:
+                value = abs(value)
+            self.statistics.update(value)
+            self.median.update(value)
+            self.count += 1
+            probes.lap('streaming statistics')
+            if until is not None and until(code):
+                break
+        return self.count
+
+    def peak_code(self):
+        ''' Largest raw code magnitude seen in the window. '''
+        return self.peak
+
+    def median_and_std(self):
+        if self.count == 0:
+            return float('nan'), float('nan')
+        return self.median.value(), self.statistics.pstdev()
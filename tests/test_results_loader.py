@@ -0,0 +1,43 @@
+''' The loader's layouts must match the headers the scripts actually write. '''
+
+import os, sys, ast, csv
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import results_loader
+
+def script_fieldnames(script):
+    ''' The fieldnames list assigned in the script's main(), read from its source. '''
+    with open(os.path.join(root, script + '.py')) as source:
+        tree = ast.parse(source.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef) and node.name == 'main':
+            for statement in ast.walk(node):
+                if isinstance(statement, ast.Assign) and any(getattr(target, 'id', None) == 'fieldnames' for target in statement.targets):
+                    return ast.literal_eval(statement.value)
+    raise LookupError("No fieldnames in " + script)
+
+@pytest.mark.parametrize('script, layout', [
+    ('constant_current_no_pH', 'constant_current_no_pH'),
+    ('AC_measurement', 'AC_measurement'),
+    ('constant_current', 'constant_current'),
+    ('AC_external_constant_current', 'constant_current'),
+    ('constant_current_2_wire', 'constant_current_2_wire'),
+    ('array_constant_100uA', 'array_constant_100uA'),
+    ('jianan_constant_100uA', 'jianan_constant_100uA'),
+])
+def test_layout_matches_script(tmp_path, script, layout):
+    fieldnames = script_fieldnames(script)
+    assert results_loader.identify_layout(fieldnames) == layout
+
+    path = str(tmp_path / 'results.csv')
+    with open(path, 'w', newline = '') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(fieldnames)
+        writer.writerow(['2020-3-5', '12:3:4.5678'] + [str(column) for column in range(len(fieldnames) - 2)])
+    results = results_loader.load_results(path, cache = False)
+    assert results.layout == layout
+    assert results.values.shape == (1, len(fieldnames) - 2)
+    assert list(results.values[0]) == list(range(len(fieldnames) - 2))
@@ -0,0 +1,74 @@
+'''
+#~ Preallocated window buffers for GaN_measurement().
+
+Reading a window into a Python list and handing it to np.median/np.std
+allocates fresh lists and arrays for every pair on every cycle. A
+WindowBuffer is allocated once per window length and reused: raw 24-bit
+codes are written into an int32 array, converted to mV in one vectorised
+step into a float64 array, and the median and standard deviation are
+computed in a scratch array of the same size.
+
+'''
+
+import numpy as np
+from data_ready import collect_conversion
+from instrumentation import no_probes
+
+def code_to_mV(codes, reference, gain, out = None):
+    ''' Converts ADS1261 codes to mV: one LSB is reference/(gain * 2^23). '''
+    return np.multiply(codes, float(reference) / (gain * 2**23), out = out)
+
+class WindowBuffer(object):
+    ''' Reusable storage for one window of conversions. '''
+
+    def __init__(self, window):
+        self.window = window
+        self.codes = np.zeros(window, dtype = np.int32)
+        self.millivolts = np.zeros(window, dtype = np.float64)
+        self.scratch = np.zeros(window, dtype = np.float64)
+        self.count = 0
+
+    def read(self, adc, data_ready = None, reference = 5000, gain = 1, status = 'enabled', absolute = False, probes = no_probes, until = None, skip = (TimeoutError,)):
+        ''' Fills the buffer with one window of raw codes, then converts them to mV.
+            A conversion that raises one of skip (by default a DRDY timeout) is printed and
+            skipped; anything else propagates. until(code), if given, can end the window
+            early (see convergence.py). Returns the mV values as a view. '''
+        codes = self.codes
+        count = 0
+        try:
+            for i in range(self.window):
+                try:
+                    code = collect_conversion(adc, data_ready, reference = reference, gain = gain, status = status, bits = True)
+                    codes[count] = code
+                    count += 1
+                    probes.lap('collect_measurement')
+                    if until is not None and until(code):
+                        break
+                except skip as e:
+                    print("Skipped a conversion:", e)
+        finally: # keep whatever was collected if the window is interrupted
+            self.count = count
+            code_to_mV(codes[:count], reference, gain, out = self.millivolts[:count])
+            if absolute:
+                np.abs(self.millivolts[:count], out = self.millivolts[:count])
+        return self.millivolts[:count]
+
+    def peak_code(self):
+        ''' Largest raw code magnitude in the last window. '''
+        if self.count == 0:
+            return 0
+        codes = self.codes[:self.count]
+        return max(int(codes.max()), -int(codes.min()))
+
+    def median_and_std(self):
+        ''' Median and (population) standard deviation of the last window, without allocating arrays.
+            NaN for both if the window is empty. '''
+        if self.count == 0:
+            return float('nan'), float('nan')
+        values, scratch = self.millivolts[:self.count], self.scratch[:self.count]
+        np.copyto(scratch, values)
+        median = np.median(scratch, overwrite_input = True)
+        mean = values.mean()
+        np.subtract(values, mean, out = scratch)
+        np.multiply(scratch, scratch, out = scratch)
+        return median, np.sqrt(scratch.mean())
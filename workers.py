@@ -0,0 +1,81 @@
+'''
+#~ Long-lived worker threads for the datalogger scripts.
+
+Creating a new threading.Thread and queue.Queue for multiplex(),
+commercial_pH() and write_to_csv() on every cycle adds start-up cost and
+jitter to each measurement. Instead, each job runs on one worker for the
+whole experiment and the workers are connected by bounded queues:
+
+LoopWorker      calls its task over and over and puts (name, start time, result)
+                on its output queue
+WriterWorker    takes items off its input queue and hands each one to a sink
+
+A full queue blocks the producer, so a slow sink holds up acquisition
+rather than growing memory without bound. Call shutdown() to stop: the
+loop workers finish their current cycle and the writers drain what is
+left in their queues before exiting.
+
+'''
+
+import time, threading, queue
+
+class LoopWorker(threading.Thread):
+    ''' Runs task() repeatedly until stop is set. '''
+
+    def __init__(self, name, task, output, stop):
+        threading.Thread.__init__(self, name = name)
+        self.daemon = True
+        self.task = task
+        self.output = output
+        self.stop = stop
+
+    def run(self):
+        while not self.stop.is_set():
+            started = time.time()
+            try:
+                result = self.task()
+            except Exception as e:
+                print("Error in", self.name, "worker")
+                print(e)
+                self.stop.wait(0.1) # don't spin if the device has gone away
+                continue
+            put(self.output, (self.name, started, result), self.stop)
+
+class WriterWorker(threading.Thread):
+    ''' Hands every item from its input queue to write(*item). Drains the queue once stopped. '''
+
+    def __init__(self, name, write, input, stop):
+        threading.Thread.__init__(self, name = name)
+        self.daemon = True
+        self.write = write
+        self.input = input
+        self.stop = stop
+
+    def run(self):
+        while not (self.stop.is_set() and self.input.empty()):
+            try:
+                item = self.input.get(timeout = 0.1)
+            except queue.Empty:
+                continue
+            try:
+                self.write(*item)
+            except Exception as e:
+                print("Error in", self.name, "worker")
+                print(e)
+
+def put(output, item, stop, timeout = 0.1):
+    ''' Blocking put on a bounded queue that gives up once stop is set. Returns True if the item was queued. '''
+    while True:
+        try:
+            output.put(item, timeout = timeout)
+            return True
+        except queue.Full:
+            if stop.is_set():
+                return False
+
+def shutdown(workers, stop, timeout = 10):
+    ''' Stops the workers and waits for them to finish. '''
+    stop.set()
+    for worker in workers:
+        worker.join(timeout)
+    return 0